@@ -34,6 +34,7 @@ if sys.version_info >= (3, 6):
 
 # defer imports for proper ordering
 from .detection import TermStack
+from .output import batch
 
 if env.PY_CONSOLE_AUTODETECT != '0':
 
@@ -47,4 +48,4 @@ if env.PY_CONSOLE_AUTODETECT != '0':
         from .style import fg, bg, fx, defx
         from .screen import screen as sc
 
-        fg, bg, fx, defx, sc, TermStack  # quiet pyflakes
+        fg, bg, fx, defx, sc, TermStack, batch  # quiet pyflakes
@@ -0,0 +1,427 @@
+# -*- coding: future_fstrings -*-
+'''
+    .. console - Comprehensive utility library for ANSI terminals.
+    .. © 2018, Mike Miller - Released under the LGPL, version 3+.
+
+    Micro-benchmarks of performance sensitive paths, run with::
+
+        python3 -m console.bench [name…]
+
+    Names select benchmarks by substring, all are run by default.
+'''
+import sys
+from timeit import repeat
+
+from . import color_tables, proximity, style
+from .constants import ALL_PALETTES
+
+proximity.build_color_tables(base=color_tables.xterm_palette4)
+
+# configure our own - force all palettes on
+fg = style.ForegroundPalette(palettes=ALL_PALETTES)
+bg = style.BackgroundPalette(palettes=ALL_PALETTES)
+fx = style.EffectsPalette(palettes=ALL_PALETTES)
+
+
+def timed(stmt, number=100000, repeats=5, **namespace):
+    ''' Return the best time per loop in µs. '''
+    namespace.setdefault('fg', fg)
+    namespace.setdefault('bg', bg)
+    namespace.setdefault('fx', fx)
+    times = repeat(stmt, number=number, repeat=repeats, globals=namespace)
+    return min(times) / number * 1000000
+
+
+def report(caption, *results):
+    ''' Print (label, µs) pairs under a caption. '''
+    print(f'\n{caption}:')
+    for label, usecs in results:
+        print(f'    {label:40.40s} {usecs:10.3f} µs')
+
+
+def bench_entry_constructors():
+    ''' Cached entry lookup: getattr of a built name vs. constructors. '''
+    report('Truecolor entry, cached',
+        ('getattr(bg, "t%02x%02x%02x" % rgb)',
+            timed('getattr(bg, "t%02x%02x%02x" % rgb)', rgb=(187, 0, 187))),
+        ('bg.rgb(*rgb)', timed('bg.rgb(*rgb)', rgb=(187, 0, 187))),
+        ('bg.hex("bb00bb")', timed('bg.hex("bb00bb")')),
+    )
+    fgc = style.ForegroundPalette(palettes=ALL_PALETTES, cache_size=4096)
+    report('Truecolor entry, cached, bounded',
+        ('getattr(fgc, "t%02x%02x%02x" % rgb)',
+            timed('getattr(fgc, "t%02x%02x%02x" % rgb)', fgc=fgc,
+                  rgb=(187, 0, 187))),
+        ('fgc.rgb(*rgb)', timed('fgc.rgb(*rgb)', fgc=fgc, rgb=(187, 0, 187))),
+    )
+    # cleared each loop: parsing, downgrade & creation included
+    fge = style.ForegroundPalette(palettes=('basic', 'extended'))
+    report('Truecolor entry, uncached, downgraded to extended',
+        ('getattr(fge, "t%02x%02x%02x" % rgb)',
+            timed('fge.clear(); getattr(fge, "t%02x%02x%02x" % rgb)',
+                  number=10000, fge=fge, rgb=(187, 0, 187))),
+        ('fge.rgb(*rgb)',
+            timed('fge.clear(); fge.rgb(*rgb)', number=10000, fge=fge,
+                  rgb=(187, 0, 187))),
+    )
+
+def bench_entry_render():
+    ''' Rendering entries: str, call, template, concatenation. '''
+    red_bold = fg.red + fx.bold
+    report('Entry rendering',
+        ('str(fg.red)', timed('str(fg.red)')),
+        ('fg.red + "text"', timed('fg.red + "text"')),
+        ('fg.red("short")', timed('fg.red("short")')),
+        ('red_bold("short")', timed('red_bold("short")', red_bold=red_bold)),
+        ('fg.red("two\\nlines")', timed('fg.red("two\\nlines")')),
+        ('fg.red.template()', timed('fg.red.template()')),
+    )
+
+
+def bench_entry_addition():
+    ''' Composing entries, repeatedly. '''
+    report('Entry addition',
+        ('fx.bold + fg.red', timed('fx.bold + fg.red')),
+        ('fg.white + fx.bold + bg.red', timed('fg.white + fx.bold + bg.red')),
+        ('fg.red("short", fx.bold)', timed('fg.red("short", fx.bold)')),
+    )
+
+
+def bench_attribute_lookup():
+    ''' Palette attribute dispatch: cached, computed, and unknown names. '''
+    fgc = style.ForegroundPalette(palettes=ALL_PALETTES, cache_size=64)
+    fgc.t_bb00bb
+    report('Attribute lookup',
+        ('cached, bounded', timed('fgc.t_bb00bb', fgc=fgc)),
+        ('computed t_HHH', timed('fgc.clear(); fgc.t_bb00bb', fgc=fgc,
+                                 number=10000)),
+        ('computed bare name', timed('fgc.clear(); fgc.coral', fgc=fgc,
+                                     number=10000)),
+        ('unknown, hasattr', timed('hasattr(fgc, "tbob")', fgc=fgc)),
+    )
+
+
+def bench_entry_stream():
+    ''' Styling a large text (~8MB) at once vs. streamed in chunks. '''
+    text = 'INFO: Lorem ipsum dolor sit amet, consectetur adipiscing.\n' * 140000
+    report(f'Entry styling, {len(text) // 1000000}MB text',
+        ('fg.red(text)', timed('fg.red(text)', number=1, text=text)),
+        ('"".join(fg.red.stream(text))',
+            timed('"".join(fg.red.stream(text))', number=1, text=text)),
+        ('for _ in fg.red.stream(text)',
+            timed('for _ in fg.red.stream(text): pass', number=1, text=text)),
+    )
+
+
+def bench_line_writer():
+    ''' Printing 1M lines to a file, plain vs. inside a styled block. '''
+    import os
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        red = style.ForegroundPalette(palettes=ALL_PALETTES).red
+        red._stream = devnull
+        namespace = dict(red=red, devnull=devnull, number=1, repeats=3)
+        plain = timed('for i in range(1000000):\n'
+                      '    print("Lorem ipsum dolor sit amet.", file=devnull)',
+                      **namespace)
+        sys.stdout = devnull
+        styled = timed('with red:\n'
+                       '    for i in range(1000000):\n'
+                       '        print("Lorem ipsum dolor sit amet.")',
+                       **namespace)
+    sys.stdout = stdout
+    report('Line writer, 1M lines',
+        ('print(…, file=devnull)', plain),
+        ('with red: print(…)', styled),
+    )
+
+
+def bench_batch():
+    ''' A frame of 100 escape sequence writes, flushed each vs. batched. '''
+    import os
+    from . import batch
+    from .screen import Screen
+    from .utils import clear_line
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        namespace = dict(batch=batch, clear_line=clear_line, number=1000,
+                         sc=Screen(force=True, stream=devnull))
+        frame = ('    for i in range(50):\n'
+                 '        with sc.location(1, i):\n'
+                 '            clear_line()\n')
+        results = (
+            ('write, flush each', timed('if True:\n' + frame, **namespace)),
+            ('with batch()', timed('with batch():\n' + frame, **namespace)),
+        )
+    sys.stdout = stdout
+    report('Batched output, 150 writes', *results)
+
+
+def bench_screen_frame():
+    ''' A dashboard frame of 40 rows: move, erase, and text per row. '''
+    import os
+    from .screen import Screen
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        sc = Screen(force=True, stream=devnull)
+        namespace = dict(sc=sc, devnull=devnull, number=1000)
+        results = (
+            ('print(…, flush=True) per row', timed(
+                'for y in range(1, 41):\n'
+                '    print(sc.mv(y, 1), sc.erase_line(2), "cpu 42%", sep="",'
+                ' end="", flush=True)', **namespace)),
+            ('with sc.frame()', timed(
+                'with sc.frame() as frame:\n'
+                '    for y in range(1, 41):\n'
+                '        frame.move(1, y)\n'
+                '        frame.erase_line()\n'
+                '        frame.write("cpu 42%")', **namespace)),
+        )
+    sys.stdout = stdout
+    report('Screen frame, 40 rows', *results)
+
+
+def bench_virtual_screen():
+    ''' A 120x40 dashboard tick, 20 fields changed: repaint vs. present. '''
+    import os
+    from .screen import Screen, VirtualScreen
+    rows = [(f'host{y:02d}  ', (fg.green, fx.bold)[y % 2]) for y in range(40)]
+
+    def draw(view, tick):
+        for y, (label, entry) in enumerate(rows):
+            view.put(0, y, label, entry)
+            view.put(10, y, f'cpu {(tick * y) % 100 if y < 20 else y:3d}%')
+            view.put(20, y, 'Lorem ipsum dolor sit amet.' * 3)
+
+    with open(os.devnull, 'w') as devnull:
+        sc = Screen(force=True, stream=devnull)
+        repaint, view = VirtualScreen(120, 40, sc), VirtualScreen(120, 40, sc)
+        bytes_repaint, bytes_present = [], []
+
+        def tick_repaint(tick):
+            draw(repaint, tick)
+            repaint.redraw()
+            bytes_repaint.append(len(repaint.present()))
+
+        def tick_present(tick):
+            draw(view, tick)
+            bytes_present.append(len(view.present()))
+
+        namespace = dict(tick_repaint=tick_repaint, tick_present=tick_present,
+                         number=1000)
+        results = (
+            ('clear and repaint', timed('tick_repaint(1)', **namespace)),
+            ('present() changes', timed('tick_present(1 + len(bytes_present))',
+                                        bytes_present=bytes_present,
+                                        **namespace)),
+        )
+    report('Virtual screen, per tick', *results)
+    print(f'    {"bytes, repaint / present":40.40s} '
+          f'{bytes_repaint[-1]:6d} / {bytes_present[-1]:d}')
+
+
+def bench_cursor_planner():
+    ''' Cursor moves of a replayed dashboard, 300 ticks of 120x40. '''
+    import os
+    from .screen import CursorPlanner, Screen, VirtualScreen
+    with open(os.devnull, 'w') as devnull:
+        sc = Screen(force=True, stream=devnull)
+        view = VirtualScreen(120, 40, sc)
+        for tick in range(300):     # a clock, a column of gauges, a status
+            view.put(110, 0, f'{tick // 60:02d}:{tick % 60:02d}')
+            for y in range(2, 38):
+                if (tick + y) % 3 == 0:
+                    view.put(10, y, f'cpu {(tick * y) % 100:3d}%')
+                    view.put(60, y, '#' * ((tick + y) % 40) + ' ' * 40)
+            view.put(0, 39, f'ok, {tick} updates')
+            view.present()
+
+    targets = [(x, y) for y in range(2, 38) for x in (10, 60)]
+    planner = CursorPlanner(sc)
+    report('Cursor planner',
+        ('move(x, y), sequential targets', timed(
+            'for x, y in targets:\n'
+            '    planner.move(x, y)\n'
+            '    planner.advance(8)', number=1000, planner=planner,
+            targets=targets) / len(targets)),
+        ('screen.mv(y, x), absolute', timed(
+            'for x, y in targets:\n'
+            '    sc.mv(y + 1, x + 1)', number=1000, sc=sc,
+            targets=targets) / len(targets)),
+    )
+    naive, emitted, saved = view.planner.info()
+    print(f'    {"bytes of moves, absolute / planned":40.40s} '
+          f'{naive:6d} / {emitted:d}, {saved / naive:.0%} saved')
+
+
+def bench_parser():
+    ''' Parsing 10MB of styled log lines into tokens. '''
+    from .parser import Parser
+    line = (f'{fx.dim}2018-10-05 12:00:01{fx.end} {fg.red + fx.bold}ERROR'
+            f'{fx.end} \x1b]8;;http://example.com\x1b\\link\x1b]8;;\x1b\\ '
+            'disk /dev/sda1 is full, 99% used.  Lorem ipsum dolor sit amet.\n')
+    text = line * (10000000 // len(line))
+    plain = 'Lorem ipsum dolor sit amet. ' * (10000000 // 28)
+    namespace = dict(Parser=Parser, text=text, plain=plain, number=1,
+                     repeats=3)
+    results = (
+        ('Parser().feed(styled text)', timed('Parser().feed(text)',
+                                             **namespace)),
+        ('Parser().feed(plain text)', timed('Parser().feed(plain)',
+                                            **namespace)),
+    )
+    report('Parser, 10MB', *results)
+    for label, usecs in results:
+        print(f'    {label:40.40s} {10000000 / usecs:10.1f} MB/s')
+
+
+def bench_sgr_renderer():
+    ''' Adjacent styled segments, full sequences vs. SGR state changes. '''
+    from .core import SGRRenderer
+    row = [(fg.red, 'ERROR'), (None, ' '), (fx.dim, '12:00:01'), (None, ' '),
+           (fg.red + fx.bold, 'disk'), (fg.red, ' is full: '),
+           (fg.yellow + fx.bold, '99%'), (fg.yellow, ' used')] * 10
+    renderer = SGRRenderer()
+    renderer.render(row)
+    naive, emitted, saved = renderer.info()
+    report(f'SGR renderer, {len(row)} segments, '
+           f'{naive} -> {emitted} bytes, {saved / naive:.0%} saved',
+        ('join(style(text))',
+            timed('"".join([s(t) if s else t for s, t in row])', row=row,
+                  number=10000)),
+        ('renderer.render(row)', timed('renderer.render(row)', row=row,
+                                       renderer=renderer, number=10000)),
+    )
+
+
+def bench_strip_ansi():
+    ''' Stripping 100MB of log data: former regex chain vs. single pass. '''
+    from .utils import (strip_ansi, ansi_csi0_finder, ansi_csi1_finder,
+                        ansi_osc0_finder, ansi_osc1_finder)
+
+    def strip_chain(text):  # as before, all options
+        text = ansi_csi0_finder.sub('', text)
+        text = ansi_osc0_finder.sub('', text)
+        text = ansi_csi1_finder.sub('', text)
+        return ansi_osc1_finder.sub('', text)
+
+    line = (f'{fx.dim}2018-10-05 12:00:01{fx.end} {fg.red + fx.bold}ERROR'
+            f'{fx.end} \x1b]8;;http://example.com\x1b\\link\x1b]8;;\x1b\\ '
+            'disk /dev/sda1 is full, 99% used.  Lorem ipsum dolor sit amet.\n')
+    text = line * (100000000 // len(line))
+    data = text.encode('latin1')
+    namespace = dict(text=text, data=data, strip_ansi=strip_ansi,
+                     strip_chain=strip_chain, number=1, repeats=3)
+    results = (
+        ('regex chain, str', timed('strip_chain(text)', **namespace)),
+        ('single pass, str',
+            timed('strip_ansi(text, c1=True, osc=True)', **namespace)),
+        ('single pass, bytes',
+            timed('strip_ansi(data, c1=True, osc=True)', **namespace)),
+    )
+    report(f'Strip ANSI, {len(text) // 1000000}MB', *results)
+    for label, usecs in results:
+        print(f'    {label:40.40s} {len(text) / usecs:10.1f} MB/s')
+
+
+def bench_width():
+    ''' Measuring a styled line: length stripped vs. display width. '''
+    from .utils import display_width, len_stripped, strip_ansi
+    ascii_line = f'{fg.red}ERROR{fx.end} Disk /dev/sda1 is full, 99% used.'
+    wide_line = f'{fg.red}エラー{fx.end} ディスクがいっぱいです。99% 使用済み。'
+    namespace = dict(display_width=display_width, len_stripped=len_stripped,
+                     strip_ansi=strip_ansi, ascii_line=ascii_line,
+                     wide_line=wide_line)
+    report('Width of a styled line',
+        ('len(strip_ansi(ascii_line))',
+            timed('len(strip_ansi(ascii_line))', **namespace)),
+        ('len_stripped(ascii_line)',
+            timed('len_stripped(ascii_line)', **namespace)),
+        ('display_width(ascii_line), cached',
+            timed('display_width(ascii_line)', **namespace)),
+        ('display_width(ascii_line)',
+            timed('display_width.cache_clear(); display_width(ascii_line)',
+                  **namespace)),
+        ('display_width(wide_line)',
+            timed('display_width.cache_clear(); display_width(wide_line)',
+                  **namespace)),
+    )
+
+
+def bench_stripper():
+    ''' Stripping 64KB chunks of a pipe: copying vs. AnsiStripper.feed. '''
+    from .utils import AnsiStripper
+    line = b'disk /dev/sda1 is full, 99% used.  Lorem ipsum dolor sit amet.\n'
+    plain = line * (65536 // len(line))
+    styled = (f'{fg.red}ERROR{fx.end} '.encode() + line) * (65536 // len(line))
+    namespace = dict(stripper=AnsiStripper(osc=True), plain=plain,
+                     styled=styled[:-7], number=1000)     # cut mid-sequence
+    results = (
+        ('bytes(memoryview(plain))',
+            timed('bytes(memoryview(plain))', **namespace)),
+        ('stripper.feed(plain)', timed('stripper.feed(plain)', **namespace)),
+        ('stripper.feed(styled)', timed('stripper.feed(styled)', **namespace)),
+    )
+    report('Incremental stripping, 64KB chunks', *results)
+    for label, usecs in results:
+        print(f'    {label:40.40s} {65536 / usecs:10.1f} MB/s')
+
+
+def bench_template():
+    ''' Formatting 10k styled log rows: str.format vs. a compiled template. '''
+    from .template import StyleTemplate
+    fmt = '{fx.dim}{0}{fx.end} {fg.red+fx.bold}{1:<5}{fx.end} {2}'
+    rows = [('12:00:01', 'ERROR', f'Disk {i} is full.') for i in range(10000)]
+    palettes = dict(fg=fg, bg=bg, fx=fx)
+    tmpl = StyleTemplate(fmt, palettes)
+    namespace = dict(rows=rows, tmpl=tmpl, number=10,
+                     styled=fmt.replace('fg.red+fx.bold', 'red_bold'),
+                     red_bold=fg.red + fx.bold)
+    report('Template, 10k rows',
+        ('"".join(str.format(…) for row)',
+            timed('"".join([styled.format(*row, fg=fg, fx=fx, '
+                  'red_bold=red_bold) + "\\n" for row in rows])', **namespace)),
+        ('tmpl.render_many(rows)', timed('tmpl.render_many(rows)',
+                                         **namespace)),
+    )
+
+
+def bench_markup():
+    ''' A styled log line: concatenated entries vs. cached markup. '''
+    from .template import compile_markup
+    palettes = dict(fg=fg, bg=bg, fx=fx)
+    namespace = dict(compile_markup=compile_markup, palettes=palettes)
+    report('Markup, one line',
+        ('(fx.bold + fg.red)(…) + fx.dim(…)',
+            timed('(fx.bold + fg.red)("ERROR") + " " + fx.dim("Disk full.")',
+                  **namespace)),
+        ('compile_markup(…).render(msg=…)',
+            timed('compile_markup("[bold red]ERROR[/] [dim]{msg}[/]", '
+                  'palettes).render(msg="Disk full.")', **namespace)),
+    )
+
+
+def bench_construction():
+    ''' Instantiation of palettes and screens. '''
+    from .screen import Screen
+    report('Construction',
+        *((name, timed(f'{name}(palettes=ALL_PALETTES)', number=10000,
+                       ALL_PALETTES=ALL_PALETTES, **{name: cls}))
+          for name, cls in (('ForegroundPalette', style.ForegroundPalette),
+                            ('EffectsPalette', style.EffectsPalette),
+                            ('EffectsTerminator', style.EffectsTerminator))),
+        ('Screen', timed('Screen(force=True)', number=10000, Screen=Screen)),
+    )
+
+
+if __name__ == '__main__':
+
+    selected = sys.argv[1:]
+    benchmarks = [(name, func) for name, func in sorted(globals().items())
+                  if name.startswith('bench_')]
+    for name, func in benchmarks:
+        if not selected or any(sel in name for sel in selected):
+            func()
+    print()
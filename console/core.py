@@ -10,6 +10,9 @@
 import sys
 import logging
 import re
+import threading
+from collections import namedtuple, OrderedDict
+from functools import lru_cache
 
 from . import _CHOSEN_PALETTE
 from .constants import (CSI, ANSI_BG_LO_BASE, ANSI_BG_HI_BASE, ANSI_FG_LO_BASE,
@@ -18,37 +21,115 @@ from .color_tables import x11_color_map as _x11_color_map
 from .disabled import empty_bin, empty
 from .detection import get_available_palettes, load_x11_color_map, X11_RGB_PATHS
 from .proximity import (color_table4, find_nearest_color_hexstr,
-                        find_nearest_color_index)
+                        find_nearest_color_index, METHODS)
 
 import env
 try:
     import webcolors
 except ImportError:
     webcolors = None
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python < 3.7
+    ContextVar = None
 
 
 log = logging.getLogger(__name__)
 MAX_NL_SEARCH = 4096
-
-# Palette attribute name finders, now we've got two problems.
-# Not a huge fan of regex but here they nicely enforce the naming rules:
+MAX_BUFFERED_LINES = 1024   # before a _LineWriter writes to its stream
+STREAM_CHUNK_SIZE = 65536   # chars read at a time, see _PaletteEntry.stream
+MAX_COMPOSITIONS = 512      # entries kept from additions, see _PaletteEntry
+_compositions = {}          # (entry, entry): entry
+_rendered_stacks = {}       # (entry, …): (start, default, separator)
+_stack_writer = None        # stands in for sys.stdout, see _StackWriter
+_stack_users = 0            # with blocks open, over all threads
+_stack_lock = threading.Lock()
+
+# Palette attribute name finder, now we've got two problems.
+# Not a huge fan of regex but here it nicely enforces the naming rules,
+# the name of the matching group is the prefix:
 _hd = r'[0-9A-Fa-f]'  # hex digits
-_index_finder = re.compile(r'^i_?\d{1,3}$', re.A)                   # i_DDD
-_nearest_finder = re.compile(f'^n_?{_hd}{{3}}$', re.A)              # n_HHH
-_true_finder = re.compile(f'^t_?({_hd}{{3}}|{_hd}{{6}})$', re.A)    # t_HHH+
-_x11_finder = re.compile(r'^x\w{4,64}$', re.A)                      # x_NAME
-_web_finder = re.compile(r'^w\w{4,64}$', re.A)                      # x_NAME
+_attr_finder = re.compile(
+    r'i_?(?P<i>\d{1,3})\Z|'                             # i_DDD
+    f'n_?(?P<n>{_hd}{{3}})\\Z|'                          # n_HHH
+    f't_?(?P<t>{_hd}{{3}}|{_hd}{{6}})\\Z|'                # t_HHH+
+    r'x(?P<x>\w{4,64})\Z|'                              # x_NAME
+    r'w(?P<w>\w{4,64})\Z',                              # w_NAME
+    re.A)
+# dispatch by prefix, to: handler(palette, attribute name, key)
+_attr_handlers = dict(
+    i=lambda pal, name, key: pal._get_extended_palette_entry(name, key),
+    n=lambda pal, name, key: pal._get_extended_palette_entry(name, key,
+                                                             is_hex=True),
+    t=lambda pal, name, key: pal._get_true_palette_entry(name, key),
+    x=lambda pal, name, key: pal._get_X11_palette_entry(key),
+    w=lambda pal, name, key: pal._get_web_palette_entry(key),
+)
+MAX_UNKNOWN_NAMES = 1024    # remembered failed lookups, per palette
+
+
+@lru_cache(maxsize=1024)
+def _entry_key(name):
+    ''' Return the cache key of an attribute name: for truecolor and index
+        names the int key of rgb() and index(), so entries are shared,
+        otherwise the name itself.
+    '''
+    match = _attr_finder.match(name) if name[:1] in ('t', 'i') else None
+    if match:
+        prefix = match.lastgroup
+        digits = match.group(prefix).lstrip('_')
+        if prefix == 't':
+            if len(digits) == 3:
+                digits = ''.join(digit * 2 for digit in digits)
+            return int(digits, 16)
+        elif prefix == 'i' and int(digits) < 256:
+            return 0x1000000 + int(digits)
+    return name
+
+
+CacheInfo = namedtuple('CacheInfo', 'hits misses evictions maxsize currsize')
+RenderInfo = namedtuple('RenderInfo', 'naive emitted saved')
+
+
+class _EntryAttribute:
+    ''' Stands in for an integer ANSI code attribute of a palette class.
+
+        On first access from a palette, creates the palette entry and stores
+        it on the instance, where it is found directly from then on.
+        Access from the class returns the code.
+    '''
+    __slots__ = ('name', 'code')
+
+    def __init__(self, name, code):
+        self.name = name
+        self.code = code
+
+    def __get__(self, palette, cls=None):
+        if palette is None:
+            return self.code
+
+        if 'basic' in palette._palette_support:
+            # the default entry is its own default:
+            attr = _PaletteEntry(palette, self.name.upper(), self.code,
+                        default=Ellipsis if self.name == 'default' else None)
+        else:
+            attr = empty
+        palette.__dict__[self.name] = attr
+        return attr
 
 
 class _BasicPaletteBuilder:
-    ''' ANSI code container for styles, fonts, etc.
+    ''' ANSI code container for styles, fonts, etc.
+
+        A base-class that modifies the attributes of child container classes.
+        Integer attributes are recognized as ANSI codes to be wrapped with a
+        manager object to provide mucho additional functionality.
+        Useful for the basic 8/16 color/fx palettes.
 
-        A base-class that modifies the attributes of child container classes on
-        initialization.  Integer attributes are recognized as ANSI codes to be
-        wrapped with a manager object to provide mucho additional
-        functionality.  Useful for the basic 8/16 color/fx palettes.
+        The codes are found once per class, on first initialization,
+        and wrapped lazily on first access.
     '''
-    def __new__(cls, palettes=Ellipsis):
+    def __new__(cls, palettes=Ellipsis, **kwargs):
         ''' Override new() to replace the class entirely on deactivation.
 
             Arguments:
@@ -58,6 +139,7 @@ class _BasicPaletteBuilder:
                               - Set explicitly with: str or sequence,
                               - Disable with: None
                               - Ellipsis - Autodetect environment.
+                kwargs      - passed on to __init__.
         '''
         self = super().__new__(cls)
         if palettes is Ellipsis:                # autodetecten-Sie
@@ -80,36 +162,185 @@ class _BasicPaletteBuilder:
         return self
 
     def __init__(self, **kwargs):
-        # look for integer attributes to wrap as a basic palette:
-        for name in ['default'] + dir(self):        # default needs to go 1st!
-            if not name.startswith('_'):
-                value = getattr(self, name)
-                if type(value) is int:
-                    if 'basic' in self._palette_support:
-                        attr = _PaletteEntry(self, name.upper(), value)
-                    else:
-                        attr = empty
-                    setattr(self, name, attr)
+        cls = type(self)
+        if '_entry_codes' not in cls.__dict__:  # once per class
+            # look for integer attributes to wrap as a basic palette:
+            codes = {}
+            for name in dir(cls):
+                if not name.startswith('_'):
+                    value = getattr(cls, name)
+                    if type(value) is int:
+                        codes[name] = value
+                        setattr(cls, name, _EntryAttribute(name, value))
+            cls._entry_codes = codes  # name: code, set last for threads
 
     def __repr__(self):
         return f'{self.__class__.__name__}(palettes={self._palette_support})'
 
 
 class _HighColorPaletteBuilder(_BasicPaletteBuilder):
-    ''' Container/Router for ANSI Extended & Truecolor palettes. '''
+    ''' Container/Router for ANSI Extended & Truecolor palettes.
 
+        Arguments:
+            basic_color_table       - Colors to downgrade to when only the
+                                      basic palette is available, and
+            extended_color_table    - when the extended is.
+                                      Default to the detected tables, may be
+                                      a sequence of rgb tuples or a
+                                      proximity.ColorTable.  These describe
+                                      the terminal's palette, an index found
+                                      is output as its slot, so are limited
+                                      to 16 and 256 entries respectively.
+            cache_size              - Max number of computed entries to keep,
+                                      least recently used are dropped first.
+                                      None - unbounded, the fastest.
+    '''
     def __init__(self,
                  x11_rgb_path=X11_RGB_PATHS,
                  downgrade_method='euclid',
+                 basic_color_table=None,
+                 extended_color_table=None,
+                 cache_size=None,
                  **kwargs):
+        self._entries = OrderedDict()   # computed entries, oldest first
+        self._unknown = {}              # name: error message
+        self._cache_size = cache_size
+        self._cache_hits = self._cache_misses = self._cache_evictions = 0
         super().__init__(**kwargs)
 
+        if downgrade_method not in METHODS:
+            raise ValueError(f'{downgrade_method!r} is not one of {METHODS}.')
+        for table, limit in ((basic_color_table, 16),
+                             (extended_color_table, 256)):
+            if table and len(table) > limit:
+                raise ValueError(f'color table of {len(table)} entries is '
+                                 f'larger than the palette, of {limit}.')
+
         self._x11_rgb_path = x11_rgb_path
         self._dg_method = downgrade_method
+        self._basic_table = basic_color_table or color_table4
+        self._extended_table = extended_color_table  # None: color_table8
 
     def __getattr__(self, name):
-        ''' Traffic cop - called only when an attribute is missing,
-            i.e. once per palette entry attribute.
+        ''' Called when an attribute is missing, i.e. once per palette entry
+            attribute, or on each access when the cache is bounded.
+        '''
+        if name[:1] == '_':  # private, never a color
+            raise AttributeError(f'{name!r} not found.')
+
+        key = _entry_key(name)
+        if self._cache_size or type(key) is int:
+            attr = self._from_cache(key)
+            if attr is not None:
+                if not self._cache_size:
+                    setattr(self, name, attr)  # found directly from now on
+                return attr
+
+        message = self._unknown.get(name)
+        if message:  # failed before
+            raise AttributeError(message)
+
+        self._cache_misses += 1
+        try:
+            attr = self._get_palette_entry(name)
+        except AttributeError as err:
+            if len(self._unknown) >= MAX_UNKNOWN_NAMES:
+                self._unknown.clear()
+            self._unknown[name] = str(err)
+            raise
+        if attr:
+            self._cache_entry(key, attr, name)
+        return attr
+
+    def _from_cache(self, key):
+        ''' Find a computed entry, or None. '''
+        attr = self._entries.get(key)
+        if attr is not None and self._cache_size:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:  # evicted by another thread meanwhile, a miss
+                return None
+            self._cache_hits += 1
+        return attr
+
+    def _cache_entry(self, key, attr, name=None):
+        ''' Save a computed entry, evicting the oldest if over the limit.
+
+            Keys are attribute names, or ints shared by truecolor and index
+            names with the constructor methods, see _entry_key.
+        '''
+        entries = self._entries
+        entries[key] = attr
+        if self._cache_size:
+            if len(entries) > self._cache_size:
+                entries.popitem(last=False)
+                self._cache_evictions += 1
+        elif name:
+            setattr(self, name, attr)  # found directly from now on
+
+    # Constructors, to skip parsing of attribute names.  Cache keys are ints:
+    # 24-bit for rgb, above that for indexes.
+    def rgb(self, r, g, b):
+        ''' Return the entry for a truecolor, downgraded as needed.
+
+            Arguments:
+                r, g, b:    int - of range 0…255
+
+            Example::
+
+                fg.rgb(187, 0, 187)  # same as fg.t_bb00bb
+        '''
+        if (r | g | b) >> 8:  # negative or > 255
+            raise ValueError(f'{(r, g, b)!r} out of range 0…255.')
+
+        key = (r << 16) | (g << 8) | b
+        attr = self._from_cache(key)
+        if attr is None:
+            self._cache_misses += 1
+            attr = self._get_true_palette_entry(f't_{key:06x}', (r, g, b))
+            if attr:
+                self._cache_entry(key, attr)
+        return attr
+
+    def hex(self, digits):
+        ''' Return the entry for a three or six digit hex string truecolor,
+            downgraded as needed.
+
+            Example::
+
+                fg.hex('bb00bb')  # same as fg.t_bb00bb
+        '''
+        value = int(digits, 16)
+        if len(digits) == 6:
+            return self.rgb(value >> 16, (value >> 8) & 0xff, value & 0xff)
+        elif len(digits) == 3:
+            return self.rgb((value >> 8) * 17, ((value >> 4) & 0xf) * 17,
+                            (value & 0xf) * 17)
+        raise ValueError(f'wrong length: {digits!r}')
+
+    def index(self, number):
+        ''' Return the entry for an extended palette index,
+            downgraded as needed.
+
+            Example::
+
+                fg.index(111)  # same as fg.i111
+        '''
+        if not 0 <= number < 256:
+            raise ValueError(f'{number!r} out of range 0…255.')
+
+        key = 0x1000000 + number
+        attr = self._from_cache(key)
+        if attr is None:
+            self._cache_misses += 1
+            attr = self._get_extended_palette_entry(f'i_{number}',
+                                                    str(number))
+            if attr:
+                self._cache_entry(key, attr)
+        return attr
+
+    def _get_palette_entry(self, name):
+        ''' Traffic cop - compute a palette entry from its attribute name.
 
             The "basic" palette will never get here, as it is already defined.
             Data flow:
@@ -138,44 +369,30 @@ class _HighColorPaletteBuilder(_BasicPaletteBuilder):
             Final Output:
                 - wrap in _PaletteEntry(output)
         '''
-        key = name[1:].lstrip('_')  # rm potential prefix
-        result = None
-
         # follow the yellow brick road…
-        if _index_finder.match(name):       # Indexed aka Extended
-            result = self._get_extended_palette_entry(name, key)
-
-        elif _nearest_finder.match(name):   # Nearest
-            result = self._get_extended_palette_entry(name, key, is_hex=True)
-
-        elif _true_finder.match(name):      # Truecolor
-            result = self._get_true_palette_entry(name, key)
-
-        elif _x11_finder.match(name):       # X11, forced via prefix
-            result = self._get_X11_palette_entry(key)
-
-        elif _web_finder.match(name):       # Webcolors, forced via prefix
-            result = self._get_web_palette_entry(key)
-
-        else:  # look for bare names (without prefix)
+        match = _attr_finder.match(name) if name[:1] in _attr_handlers else None
+        if match:  # Indexed, Nearest, Truecolor, X11, or Webcolors
+            prefix = match.lastgroup
+            key = match.group(prefix).lstrip('_')  # rm potential prefix
+            return _attr_handlers[prefix](self, name, key)
+
+        # look for bare names (without prefix), webcolors then X11:
+        color = None
+        if webcolors:
             try:
-                result = self._get_web_palette_entry(name)
-                if result:
-                    return result
-            except AttributeError:
+                color = webcolors.name_to_rgb(name)
+            except ValueError:
                 pass  # nope, didn't find…
 
-            try:  # try X11
-                result = self._get_X11_palette_entry(name)
-                if result:
-                    return result
-            except AttributeError:
-                pass  # nada
+        if color is None and self._x11_rgb_path:
+            if not _x11_color_map:
+                load_x11_color_map(self._x11_rgb_path)
+            color = _x11_color_map.get(name.lower())
 
-            # Emerald city
+        if color is None:  # Emerald city
             raise AttributeError(f'{name!r} is not a recognized attribute name'
                                  ' or format.')
-        return result
+        return self._get_true_palette_entry(name, color)
 
     def _get_extended_palette_entry(self, name, index, is_hex=False):
         ''' Compute extended entry, once on the fly. '''
@@ -185,7 +402,8 @@ class _HighColorPaletteBuilder(_BasicPaletteBuilder):
         if 'extended' in self._palette_support:  # build entry
             if is_hex:
                 index = str(find_nearest_color_hexstr(index,
-                                                      method=self._dg_method))
+                                        color_table=self._extended_table,
+                                        method=self._dg_method))
             start_codes = self._start_codes_extended
             if is_fbterm:
                 start_codes = self._start_codes_extended_fbterm
@@ -195,13 +413,14 @@ class _HighColorPaletteBuilder(_BasicPaletteBuilder):
         # downgrade section
         elif 'basic' in self._palette_support:
             if is_hex:
-                nearest_idx = find_nearest_color_hexstr(index, color_table4,
-                                                        method=self._dg_method)
+                nearest_idx = find_nearest_color_hexstr(index,
+                                                self._basic_table,
+                                                method=self._dg_method)
             else:
                 from .color_tables import index_to_rgb8  # find rgb for idx
                 nearest_idx = find_nearest_color_index(*index_to_rgb8[index],
-                                                       color_table=color_table4,
-                                                       method=self._dg_method)
+                                                color_table=self._basic_table,
+                                                method=self._dg_method)
             values = self._index_to_ansi_values(nearest_idx)
 
         return (self._create_entry(name, values, fbterm=is_fbterm)
@@ -230,12 +449,14 @@ class _HighColorPaletteBuilder(_BasicPaletteBuilder):
         elif 'extended' in self._palette_support:
             if type_digits is str:
                 nearest_idx = find_nearest_color_hexstr(digits,
-                                                       method=self._dg_method)
+                                            color_table=self._extended_table,
+                                            method=self._dg_method)
             else:  # tuple
                 if type(digits[0]) is str:  # convert to ints
                     digits = tuple(int(digit) for digit in digits)
                 nearest_idx = find_nearest_color_index(*digits,
-                                                       method=self._dg_method)
+                                            color_table=self._extended_table,
+                                            method=self._dg_method)
 
             start_codes = self._start_codes_extended
             if is_fbterm:
@@ -245,14 +466,15 @@ class _HighColorPaletteBuilder(_BasicPaletteBuilder):
 
         elif 'basic' in self._palette_support:
             if type_digits is str:
-                nearest_idx = find_nearest_color_hexstr(digits, color_table4,
-                                                       method=self._dg_method)
+                nearest_idx = find_nearest_color_hexstr(digits,
+                                                self._basic_table,
+                                                method=self._dg_method)
             else:  # tuple
                 if type(digits[0]) is str:  # convert to ints
                     digits = tuple(int(digit) for digit in digits)
                 nearest_idx = find_nearest_color_index(*digits,
-                                                       color_table=color_table4,
-                                                       method=self._dg_method)
+                                                color_table=self._basic_table,
+                                                method=self._dg_method)
             values = self._index_to_ansi_values(nearest_idx)
 
         return (self._create_entry(name, values, fbterm=is_fbterm)
@@ -306,49 +528,214 @@ class _HighColorPaletteBuilder(_BasicPaletteBuilder):
 
     def _create_entry(self, name, values, fbterm=False):
         ''' Render first values as string and place as first code,
-            save, and return attr.
+            and return attr.  Caching is done by __getattr__.
         '''
         if fbterm:
             attr = _PaletteEntryFBTerm(self, name.upper(), ';'.join(values))
         else:
             attr = _PaletteEntry(self, name.upper(), ';'.join(values))
-        setattr(self, name, attr)  # now cached
         return attr
 
+    def cache_info(self):
+        ''' Report statistics on computed (non-basic) entries.
+
+            Returns:
+                CacheInfo: hits, misses, evictions, maxsize, currsize
+                Hits are counted only when the cache is bounded,
+                otherwise entries are found without a lookup.
+        '''
+        return CacheInfo(self._cache_hits, self._cache_misses,
+                         self._cache_evictions, self._cache_size,
+                         len(self._entries))
+
     def clear(self):
-        ''' Cleanse the palette to free memory.
-            Useful for truecolor, perhaps.
+        ''' Cleanse the palette of computed entries to free memory.
+            Useful for truecolor, perhaps.  Basic entries remain.
         '''
-        self.__dict__.clear()
+        if not self._cache_size:  # stored as attributes too, by name
+            computed = {id(attr) for attr in self._entries.values()}
+            for name, attr in list(vars(self).items()):
+                if id(attr) in computed:
+                    del self.__dict__[name]
+        self._entries.clear()
+        self._unknown.clear()
+        self._cache_hits = self._cache_misses = self._cache_evictions = 0
+
+
+def _style_lines(data, start, default, separator):
+    ''' Wrap data in start & default sequences, terminated at newlines. '''
+    if '\n' not in data:
+        return start + data + default
+    elif data[-1] == '\n':  # mv nl to end:
+        return (start + data[:-1].replace('\n', separator) + default + '\n')
+    else:
+        return start + data.replace('\n', separator) + default
 
 
 class _LineWriter(object):
     ''' Writes each line with escape sequences terminated so paging works
         correctly, a la Pygments.
+
+        Styled output is buffered and written to the stream in one call
+        per max_lines lines, on flush, or before the stream is accessed.
+        Interactive streams are written per line.
     '''
-    def __init__(self, start, stream, default):
-        self.start = start
+    def __init__(self, start, stream, default, max_lines=None):
+        self._buffer = []
+        self._lines = 0
+        self.start = start = str(start)
         self.stream = stream
-        self.default = default
+        self.default = default = str(default)
+        self._separator = f'{default}\n{start}'
+        if max_lines is None:
+            try:
+                interactive = stream.isatty()
+            except (AttributeError, ValueError):  # unusual, or closed
+                interactive = False
+            max_lines = 1 if interactive else MAX_BUFFERED_LINES
+        self.max_lines = max_lines
 
     def write(self, data):
-        ''' This could be a bit less clumsy. '''
+        ''' Style data and add to the buffer. '''
         if data == '\n':  # print does this
-            return self.stream.write(data)
-        else:
-            bytes_ = 0
-            for line in data.splitlines(True):
-                nl = ''
-                if line.endswith('\n'):  # mv nl to end:
-                    line = line[:-1]
-                    nl = '\n'
-                bytes_ += self.stream.write(
-                                f'{self.start}{line}{self.default}{nl}'
-                          ) or 0  # in case None returned (on Windows)
-            return bytes_
+            self._buffer.append(data)
+            self._lines += 1
+        elif data:
+            self._buffer.append(_style_lines(data, self.start, self.default,
+                                             self._separator))
+            self._lines += data.count('\n')
+        if self._lines >= self.max_lines:
+            self._flush_buffer()
+        return len(data)
+
+    def _flush_buffer(self):
+        if self._buffer:
+            self.stream.write(''.join(self._buffer))
+            self._buffer.clear()
+        self._lines = 0
+
+    def flush(self):
+        ''' Write buffered output, then flush the stream. '''
+        self._flush_buffer()
+        flush = getattr(self.stream, 'flush', None)
+        if flush:
+            flush()
 
     def __getattr__(self, attr):
-         return getattr(self.stream, attr)
+        self._flush_buffer()  # stream is current before used directly
+        return getattr(self.stream, attr)
+
+
+class _StackWriter(_LineWriter):
+    ''' Stands in for sys.stdout while entries are used as context managers.
+
+        Output is styled by the entries entered in the current thread or
+        asyncio task, kept in a context variable, or passed through
+        unchanged when there are none.  One writer is shared by all.
+    '''
+    def __init__(self, stream):
+        super().__init__('', stream, '')
+        self._lock = threading.Lock()
+        self._last = (None, None)           # last stack seen, rendered
+
+    def write(self, data):
+        ''' Style data by the current stack and add to the buffer. '''
+        if data == '\n':  # print does this
+            self._buffer.append(data)
+            self._lines += 1
+        elif data:
+            styles = _style_stack.get()
+            if styles:
+                last_styles, style = self._last    # same stack as last time?
+                if styles is not last_styles:
+                    style = _render_stack(styles)
+                    self._last = (styles, style)
+                target = styles[-1]._stream
+                if target is not self.stream:  # see set_output
+                    self._flush_buffer()
+                    target.write(_style_lines(data, *style))
+                    return len(data)
+                self._buffer.append(_style_lines(data, *style))
+            else:
+                self._buffer.append(data)
+            self._lines += data.count('\n')
+        if self._lines >= self.max_lines:
+            self._flush_buffer()
+        return len(data)
+
+    def _flush_buffer(self):
+        ''' Appends may arrive from other threads meanwhile, keep them. '''
+        with self._lock:
+            buffer = self._buffer
+            if buffer:
+                count = len(buffer)
+                self.stream.write(''.join(buffer[:count]))
+                del buffer[:count]
+            self._lines = 0
+
+
+class _ThreadVar(threading.local):
+    ''' A minimal ContextVar, per thread, for Pythons without one. '''
+    def __init__(self, name, default=None):
+        self.value = default
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
+# entries entered as context managers, innermost last, per thread or task:
+_style_stack = (ContextVar or _ThreadVar)('console_style_stack', default=())
+
+
+def _render_stack(styles):
+    ''' Render the (start, default, separator) of a stack of entries once.
+
+        Colors overridden by a later entry of the same palette are skipped,
+        so only the differences are emitted.
+    '''
+    rendered = _rendered_stacks.get(styles)
+    if rendered is None:
+        starts, ends = [], []
+        for i, entry in enumerate(styles):
+            if (len(entry._codes) == 1 and hasattr(entry.parent, 'default')
+                and any(later.parent is entry.parent
+                        for later in styles[i + 1:])):
+                continue  # overridden
+            starts.append(entry._text)
+            if entry._end not in ends:
+                ends.append(entry._end)
+        start, default = ''.join(starts), ''.join(ends)
+        rendered = (start, default, f'{default}\n{start}')
+        if len(_rendered_stacks) >= MAX_COMPOSITIONS:
+            _rendered_stacks.clear()
+        _rendered_stacks[styles] = rendered
+    return rendered
+
+
+def _style_chunks(chunks, start, end):
+    ''' Style text arriving in chunks, with sequences terminated at newlines.
+
+        Lines may span chunks, whether a line was started is kept between
+        them, so only one chunk is held in memory at a time.
+    '''
+    separator = end + '\n' + start
+    at_line_start = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        styled = chunk.replace('\n', separator)
+        if at_line_start:
+            styled = start + styled
+        at_line_start = chunk.endswith('\n')
+        if at_line_start:  # rm the start of a line not begun yet
+            styled = styled[:len(styled) - len(start)]
+        yield styled
+
+    if not at_line_start:
+        yield end
 
 
 class _PaletteEntry:
@@ -361,63 +748,113 @@ class _PaletteEntry:
         - Provides a call interface, for use as a text wrapper.
         - Provides a Context Manager for use via the "with" statement.
 
+        The escape sequence and its terminator are rendered once on creation,
+        the entry is immutable afterward, save for its output stream.
+
         Arguments:
             parent  - Parent palette
             name    - Display name, used in demos.
-            code    - Associated ANSI code number.
+            code    - Associated ANSI code number.
             stream  - Stream to print to, when using a context manager.
+            default - Entry or str to end styled text with,
+                      defaults to the palette default,
+                      Ellipsis - the entry itself.
     '''
-    def __init__(self, parent, name, code, stream=sys.stdout):
-        self.parent = parent
-        self.default = (parent.default if hasattr(parent, 'default')
-                                       else parent.end)  # style
-        self.name = name
-        self._codes = [str(code)]           # the initial code
-        self._stream = stream               # for redirection
+    __slots__ = ('parent', 'default', 'name', '_codes', '_text', '_end',
+                 '_stream')
+    _mutable = ('_stream',)
+    _terminator = 'm'
+
+    def __init__(self, parent, name, code, stream=sys.stdout, default=None):
+        if default is None:
+            default = (parent.default if hasattr(parent, 'default')
+                                      else parent.end)  # style
+        elif default is Ellipsis:
+            default = self
+        setattr_ = object.__setattr__
+        setattr_(self, 'parent', parent)
+        setattr_(self, 'default', default)
+        setattr_(self, 'name', name)
+        setattr_(self, '_codes', (str(code),))      # the initial code
+        setattr_(self, '_text', f'{CSI}{code}{self._terminator}')
+        setattr_(self, '_end', self._text if default is self else str(default))
+        setattr_(self, '_stream', stream)           # for redirection
+
+    def __setattr__(self, name, value):
+        if name not in self._mutable:
+            raise AttributeError(f'{self.__class__.__name__} is immutable.')
+        object.__setattr__(self, name, value)
 
     def __add__(self, other):
         ''' Add: self + other '''
         if isinstance(other, str):
-            return str(self) + other
+            return self._text + other
 
         elif isinstance(other, _PaletteEntry):
+            # interned, as the same combinations tend to be used repeatedly
+            key = (self, other)
+            attr = _compositions.get(key)
+            if attr is not None:
+                return attr
+
             # Make a copy, so codes don't pile up after each addition
             # Render initial values once as string and place as first code:
             newcodes = self._codes + other._codes
-            #~ log.debug('codes for new instance: %r', newcodes)  # noisy
-            attr = _PaletteEntry(self.parent, self.name,
-                                 ';'.join(newcodes))
+            #~ log.debug('codes for new instance: %r', newcodes)  # noisy
             same_category = self.parent is other.parent
             #~ log.debug('palette entries match: %s', same_category)  # noisy
 
-            if not same_category:  # different, use end instead of default
-                attr.default = ANSI_RESET
-
+            # if different, use end instead of default
+            attr = _PaletteEntry(self.parent, self.name, ';'.join(newcodes),
+                                 default=None if same_category else ANSI_RESET)
+            if len(_compositions) >= MAX_COMPOSITIONS:  # drop oldest
+                try:    # shared by threads, as re's cache
+                    _compositions.pop(next(iter(_compositions), None), None)
+                except (RuntimeError, StopIteration):
+                    pass
+            _compositions[key] = attr
             return attr
         else:
             raise TypeError(f'Addition to type {type(other)} not supported.')
 
     def __radd__(self, other):
         ''' Reverse add: other + self '''
-        return other + str(self)
+        return other + self._text
 
     def __bool__(self):
         return bool(self._codes)
 
     def __enter__(self):
-        ''' Wrap output streams. '''
-        log.debug(repr(str(self)))
-        # wrap originals
-        self._orig_stdout = sys.stdout
-        sys.stdout = _LineWriter(self, self._stream, self.default)
-        return sys.stdout
+        ''' Push onto the style stack of this thread or task, and direct
+            stdout through the shared writer.
+        '''
+        global _stack_writer, _stack_users
+        log.debug(repr(self._text))
+        _style_stack.set(_style_stack.get() + (self,))
+        with _stack_lock:
+            if sys.stdout is not _stack_writer:  # wrap original
+                if not (_stack_writer and _stack_writer.stream is sys.stdout):
+                    _stack_writer = _StackWriter(sys.stdout)
+                sys.stdout = _stack_writer
+            _stack_users += 1
+        return _stack_writer
 
     def __exit__(self, type, value, traceback):
-        sys.stdout = sys.stdout.stream
-        self._stream.write(str(self.default))  # just in case
+        global _stack_users
+        styles = _style_stack.get()
+        if styles and styles[-1] is self:
+            styles = styles[:-1]
+            _style_stack.set(styles)
+        _stack_writer.flush()
+        with _stack_lock:
+            _stack_users -= 1
+            if not _stack_users and sys.stdout is _stack_writer:
+                sys.stdout = _stack_writer.stream   # restore original
+        if not styles:  # outer style remains otherwise
+            self._stream.write(self._end)  # just in case
 
     def __call__(self, text, *styles, original_length=False):
-        ''' Formats text.  Not appropriate for huge input strings.
+        ''' Formats text.  For huge input strings, see stream().
 
             Arguments:
                 text                Original text.
@@ -434,25 +871,62 @@ class _PaletteEntry:
         for attr in styles:
             self += attr
 
+        start = self._text
+        end = self._end
         pos = text.find('\n', 0, MAX_NL_SEARCH)  # if '\n' in text, w/limit
         if pos != -1:  # found
-            lines = text.splitlines()
-            for i, line in enumerate(lines):
-                lines[i] = f'{self}{line}{self.default}'  # add styles, see tip
-            result = '\n'.join(lines)
+            result = '\n'.join([start + line + end    # add styles, see tip
+                                 for line in text.splitlines()])
         else:
-            result = f'{self}{text}{self.default}'
+            result = start + text + end
 
         if original_length:
             return _LengthyString(len(text), result)
         else:
             return result
 
+    def stream(self, source, *styles, file=None):
+        ''' Formats text incrementally, for huge strings, files, or logs.
+
+            Arguments:
+                source              A string, file object opened in text
+                                    mode, or iterable of string chunks.
+                *styles             Add "mix-in" styles, per invocation.
+                file                Optional stream to write output to.
+            Returns:
+                A generator of styled strings, or when file is given,
+                the number of characters written.
+
+            Note:
+                As with calling the entry, sequences are terminated at
+                newlines, but line endings are kept as found.
+        '''
+        for attr in styles:
+            self += attr
+
+        if isinstance(source, str):
+            chunks = (source[i:i + STREAM_CHUNK_SIZE]
+                      for i in range(0, len(source), STREAM_CHUNK_SIZE))
+        elif hasattr(source, 'read'):
+            chunks = iter(lambda: source.read(STREAM_CHUNK_SIZE), '')
+        else:
+            chunks = source
+
+        styled = _style_chunks(chunks, self._text, self._end)
+        if file is None:
+            return styled
+
+        count = 0
+        for chunk in styled:
+            file.write(chunk)
+            count += len(chunk)
+        return count
+
     def __str__(self):
-        return f'{CSI}{";".join(self._codes)}m'
+        return self._text
 
     def __repr__(self):
-        return repr(self.__str__())
+        return repr(self._text)
 
     def template(self, placeholder='{}'):
         ''' Returns a template string from this Entry with its attributes.
@@ -460,7 +934,7 @@ class _PaletteEntry:
             Placeholder can be '%s', '{}', '${}' or other depending on your
             needs.
         '''
-        return f'{self}{placeholder}{self.default}'
+        return self._text + placeholder + self._end
 
     def set_output(self, outfile):
         ''' Set's the output file, currently only useful with context-managers.
@@ -468,17 +942,13 @@ class _PaletteEntry:
             Note:
                 This function is experimental and may not last.
         '''
-        if self._orig_stdout:  # restore Usted
-            sys.stdout = self._orig_stdout
-
         self._stream = outfile
-        sys.stdout = _LineWriter(self, self._stream, self.default)
 
 
 class _PaletteEntryFBTerm(_PaletteEntry):
     ''' Help fbterm show 256 colors. '''
-    def __str__(self):
-        return f'{CSI}{";".join(self._codes)}}}'  # '}' at end not 'm'
+    __slots__ = ()
+    _terminator = '}'  # '}' at end not 'm'
 
 
 class _LengthyString(str):
@@ -489,3 +959,173 @@ class _LengthyString(str):
         self = str.__new__(cls, content)
         self.original_length = original_length
         return self
+
+
+# SGR state: (fg, bg, effects), colors as their code strings or None:
+_SGR_DEFAULT = (None, None, frozenset())
+_SGR_FONTS = frozenset(range(11, 21))
+_SGR_OFF = {1: 22, 2: 22, 3: 23, 4: 24, 5: 25, 6: 25, 7: 27, 8: 28, 9: 29,
+            51: 54, 52: 54, 53: 55}                 # effect: code to end it
+_SGR_OFF.update((font, 10) for font in _SGR_FONTS)
+_SGR_CLEARS = {21: (1,), 22: (1, 2), 23: (3, 20), 24: (4,), 25: (5, 6),
+               27: (7,), 28: (8,), 29: (9,), 54: (51, 52), 55: (53,),
+               10: _SGR_FONTS}                      # code: effects ended
+_sgr_states = {}            # entry: state
+_sgr_transitions = {}       # (state, state): sequence
+
+
+def _parse_sgr(codes, state=_SGR_DEFAULT):
+    ''' Apply SGR codes, a sequence of strings, to a state. '''
+    fg, bg, effects = state
+    effects = set(effects)
+    params = iter(';'.join(codes).split(';'))
+    for param in params:
+        code = int(param or 0)
+        if code == 0:
+            fg = bg = None
+            effects.clear()
+        elif code in (38, 48):  # extended or true color, gather its params
+            mode = next(params, '')
+            count = 1 if mode == '5' else 3 if mode == '2' else 0
+            value = ';'.join([param, mode] +
+                             [next(params, '0') for _ in range(count)])
+            if code == 38:
+                fg = value
+            else:
+                bg = value
+        elif 30 <= code <= 37 or 90 <= code <= 97:
+            fg = param
+        elif code == 39:
+            fg = None
+        elif 40 <= code <= 47 or 100 <= code <= 107:
+            bg = param
+        elif code == 49:
+            bg = None
+        elif code in _SGR_CLEARS:
+            effects.difference_update(_SGR_CLEARS[code])
+        else:
+            if code in _SGR_FONTS:
+                effects.difference_update(_SGR_FONTS)
+            effects.add(code)
+    return fg, bg, frozenset(effects)
+
+
+def _sgr_transition(old, new):
+    ''' Return the shortest sequence to change the terminal from the old
+        state to the new: changed codes only, or a reset and the new state.
+    '''
+    sequence = _sgr_transitions.get((old, new))
+    if sequence is None:
+        fg, bg, effects = new
+        full = ['0']
+        full.extend(color for color in (fg, bg) if color)
+        full.extend(str(code) for code in sorted(effects))
+
+        removed = old[2] - effects
+        if all(code in _SGR_OFF for code in removed):
+            offs = sorted({_SGR_OFF[code] for code in removed})
+            ended = set()
+            for code in offs:
+                ended.update(_SGR_CLEARS[code])
+            added = (effects - old[2]) | (effects & ended)  # back on
+            codes = [str(code) for code in offs]
+            codes.extend(str(code) for code in sorted(added))
+            if fg != old[0]:
+                codes.append(fg or '39')
+            if bg != old[1]:
+                codes.append(bg or '49')
+            if len(';'.join(codes)) < len(';'.join(full)):
+                full = codes
+
+        sequence = f'{CSI}{";".join(full)}m' if old != new else ''
+        if len(_sgr_transitions) >= MAX_COMPOSITIONS:
+            _sgr_transitions.clear()
+        _sgr_transitions[(old, new)] = sequence
+    return sequence
+
+
+class SGRRenderer:
+    ''' Renders (style, text) segments, emitting only the SGR codes that
+        change from one segment to the next, rather than each style's full
+        start and end sequences.  What's shown is the same.
+
+        The terminal state is kept between calls to render, and the number
+        of bytes saved is available from info().
+    '''
+    def __init__(self):
+        self.state = _SGR_DEFAULT
+        self._naive = self._emitted = 0
+
+    def render(self, segments, finish=True):
+        ''' Render segments to a string.
+
+            Arguments:
+                segments    An iterable of (style, text) tuples, where style
+                            is a palette entry or None for plain text.
+                            Bare strings are taken as plain text as well.
+                finish      bool - Return the terminal to its default state
+                            at the end.
+        '''
+        parts = []
+        state = self.state
+        naive = emitted = 0     # bytes of sequences
+        for segment in segments:
+            if isinstance(segment, str):
+                style, text = None, segment
+            else:
+                style, text = segment
+
+            if not style:  # None, or a disabled entry
+                new = _SGR_DEFAULT
+            elif style._terminator == 'm':
+                new = _sgr_states.get(style)
+                if new is None:
+                    new = _parse_sgr(style._codes)
+                    if len(_sgr_states) >= MAX_COMPOSITIONS:
+                        _sgr_states.clear()
+                    _sgr_states[style] = new
+                naive += len(style._text) + len(style._end)
+            else:  # not SGR, e.g. fbterm, pass through
+                sequence = _sgr_transition(state, _SGR_DEFAULT)
+                parts.extend((sequence, style._text, text, style._end))
+                state = _SGR_DEFAULT
+                length = len(style._text) + len(style._end)
+                naive += length
+                emitted += length + len(sequence)
+                continue
+
+            if new != state:
+                sequence = _sgr_transition(state, new)
+                parts.append(sequence)
+                emitted += len(sequence)
+                state = new
+            parts.append(text)
+
+        if finish and state != _SGR_DEFAULT:
+            sequence = _sgr_transition(state, _SGR_DEFAULT)
+            parts.append(sequence)
+            emitted += len(sequence)
+            state = _SGR_DEFAULT
+
+        self.state = state
+        result = ''.join(parts)
+        total = len(result.encode('utf8', 'surrogatepass'))
+        self._naive += total - emitted + naive
+        self._emitted += total
+        return result
+
+    def info(self):
+        ''' Report the bytes output, and those saved.
+
+            Returns:
+                RenderInfo: naive, emitted, saved
+        '''
+        return RenderInfo(self._naive, self._emitted,
+                          self._naive - self._emitted)
+
+
+def render_segments(segments):
+    ''' Render (style, text) segments with minimal escape sequences,
+        see SGRRenderer.
+    '''
+    return SGRRenderer().render(segments)
@@ -10,6 +10,7 @@ if __name__ == '__main__':
 
     import sys, os
     import logging
+    from inspect import ismethod
 
     log = logging.getLogger(__name__)
     if os.name == 'nt':
@@ -61,8 +62,10 @@ if __name__ == '__main__':
         '''
         items = []
         for name in dir(obj):
-            if not name.startswith('_') and not name == 'clear':  # types !work
+            if not name.startswith('_'):
                 attr = getattr(obj, name)
+                if ismethod(attr):  # clear, rgb, etc.
+                    continue
                 if extra_style:
                     items.append(f'{attr + extra_style}{attr.name}{fx.end}')
                 else:
@@ -149,20 +152,17 @@ if __name__ == '__main__':
         # draw rounded box around gradients
         print('      ╭' + '─' * 86, '╮\n      │', sep='', end='')   # RED
         for val in range(0, 256, step):
-            code = format(val, '02x')
-            print(getattr(bg, 't%s0000' % code), fx.end, end='')
+            print(bg.rgb(val, 0, 0), fx.end, end='')
         print('│')
 
         print('      │', sep='', end='')                            # GREEN
         for val in range(255, -1, -step):
-            code = format(val, '02x')
-            print(getattr(bg, 't00%s00' % code), fx.end, end='')
+            print(bg.rgb(0, val, 0), fx.end, end='')
         print('│')
 
         print('      │', sep='', end='')                            # BLUE
         for val in range(0, 256, step):
-            code = format(val, '02x')
-            print(getattr(bg, 't0000%s' % code), fx.end, end='')
+            print(bg.rgb(0, 0, val), fx.end, end='')
         print('│')
         print('      ╰' + '─' * 86, '╯\n', sep='', end='')
         print(flush=True)
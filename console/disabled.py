@@ -26,6 +26,23 @@ class _EmptyAttribute(str):
     def __exit__(self, *args):
         pass
 
+    def stream(self, source, *args, file=None):
+        ''' Pass text through, mimicking the entry method. '''
+        if isinstance(source, str):
+            chunks = (source,)
+        elif hasattr(source, 'read'):
+            chunks = iter(lambda: source.read(65536), '')
+        else:
+            chunks = source
+        if file is None:
+            return iter(chunks)
+
+        count = 0
+        for chunk in chunks:
+            file.write(chunk)
+            count += len(chunk)
+        return count
+
     def __str__(self):
         return ''
 
@@ -47,6 +64,12 @@ class _EmptyBin:
     def __exit__(self, *args):
         pass
 
+    def rgb(self, *args):
+        ''' Mimic the palette constructor methods. '''
+        return self.an_empty
+
+    hex = index = rgb
+
 
 empty = _EmptyAttribute()
 empty_bin = _EmptyBin(empty)
@@ -0,0 +1,98 @@
+'''
+    .. console - Comprehensive utility library for ANSI terminals.
+    .. © 2018, Mike Miller - Released under the LGPL, version 3+.
+
+    Coalesced output, where escape sequences and text are gathered up and
+    written to the terminal at once, instead of a write and flush each::
+
+        with console.batch():
+            clear_screen()
+            print(sc.mv(1, 1), 'Hello, world!')
+        # written here
+
+    The functions of console.utils and Screen objects take part without
+    changes, as they write to the stream being batched.
+'''
+import sys
+import threading
+from contextlib import contextmanager
+
+
+_batches = {}               # id(stream): _BatchWriter, while open
+_batch_lock = threading.Lock()
+
+
+class _BatchWriter(object):
+    ''' Stands in for a stream, holding writes until the end of a frame.
+
+        Flushes are ignored until then, since print(…, flush=True) and
+        friends would otherwise write each piece out as it comes.
+    '''
+    def __init__(self, stream):
+        self.stream = stream
+        self.depth = 0              # nested batches open
+        self._buffer = []
+
+    def write(self, data):
+        self._buffer.append(data)
+        return len(data)
+
+    def flush(self):
+        ''' Deferred to the end of the frame. '''
+
+    def frame(self):
+        ''' End a frame: write what's been buffered in one go, and flush. '''
+        buffer = self._buffer
+        count = len(buffer)             # others may be appending
+        if count:
+            data = ''.join(buffer[:count])
+            del buffer[:count]
+            self.stream.write(data)
+        self.stream.flush()
+
+    def __getattr__(self, attr):
+        ''' Pass through to the original stream, e.g. isatty, fileno. '''
+        return getattr(self.stream, attr)
+
+
+def get_output(stream):
+    ''' Return the batch open on the given stream, or the stream itself. '''
+    return _batches.get(id(stream), stream)
+
+
+@contextmanager
+def batch(stream=None):
+    ''' Gather output to a stream, writing it at once when the block ends.
+
+        Arguments:
+            stream      Defaults to sys.stdout, which is replaced for the
+                        duration, so print() is batched as well.
+
+        Yields the writer, its frame() method writes out and flushes early,
+        e.g. between frames of an animation.  Nested blocks join the
+        outermost one.  Note that sys.stdout is shared by all threads.
+    '''
+    with _batch_lock:
+        if stream is None:
+            stream = sys.stdout
+        writer = _batches.get(id(stream))
+        if writer is None:
+            if isinstance(stream, _BatchWriter):    # inner block
+                writer = stream
+            else:
+                writer = _batches[id(stream)] = _BatchWriter(stream)
+        writer.depth += 1
+        if sys.stdout is writer.stream:
+            sys.stdout = writer
+    try:
+        yield writer
+    finally:
+        with _batch_lock:
+            writer.depth -= 1
+            done = not writer.depth
+            if done:
+                del _batches[id(writer.stream)]
+                if sys.stdout is writer:
+                    sys.stdout = writer.stream
+        if done:
+            writer.frame()
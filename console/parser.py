@@ -0,0 +1,358 @@
+# -*- coding: future_fstrings -*-
+'''
+    .. console - Comprehensive utility library for ANSI terminals.
+    .. © 2018, Mike Miller - Released under the LGPL, version 3+.
+
+    A parser of terminal output, yielding text and the escape sequences
+    in between as tokens, e.g.::
+
+        >>> list(parse('\x1b[1;31mERROR\x1b[0m'))
+        [CSI(private='', params=(1, 31), intermediates='', final='m'),
+         Text(text='ERROR'),
+         CSI(private='', params=(0,), intermediates='', final='m')]
+
+    It follows the state machine of DEC VT500 compatible terminals,
+    described by Paul Williams:
+
+        - `A parser for DEC's ANSI-compatible video terminals
+          <https://vt100.net/emu/dec_ansi_parser>`_
+
+    Text and well-formed sequences are matched whole by regex, the state
+    machine takes over for the rest, and for sequences split between chunks.
+'''
+import re
+from functools import lru_cache
+
+
+# states
+GROUND = 'ground'
+ESCAPE = 'escape'
+ESCAPE_INTERMEDIATE = 'escape_intermediate'
+CSI_ENTRY = 'csi_entry'
+CSI_PARAM = 'csi_param'
+CSI_INTERMEDIATE = 'csi_intermediate'
+CSI_IGNORE = 'csi_ignore'
+DCS_ENTRY = 'dcs_entry'
+DCS_PARAM = 'dcs_param'
+DCS_INTERMEDIATE = 'dcs_intermediate'
+DCS_PASSTHROUGH = 'dcs_passthrough'
+DCS_IGNORE = 'dcs_ignore'
+OSC_STRING = 'osc_string'
+SOS_PM_APC_STRING = 'sos_pm_apc_string'
+
+_STRING_STATES = (DCS_PASSTHROUGH, OSC_STRING, SOS_PM_APC_STRING)
+_STRING_KINDS = {'X': 'SOS', '^': 'PM', '_': 'APC',
+                 '\x98': 'SOS', '\x9e': 'PM', '\x9f': 'APC'}
+
+_token_finder = re.compile(
+    '([^\x00-\x1f\x7f-\x9f]+)'                             # text
+    '|(?:\x1b\\[|\x9b)([<=>?]?)([0-9:;]*)([ -/]*)([@-~])'   # CSI
+    '|(?:\x1b\\]|\x9d)([^\x00-\x1f\x7f-\x9f]*)'             # OSC
+    '(?:\x07|\x1b\\\\|\x9c)'
+    '|\x1b([ -/]*)([0-OQ-WYZ\\\\`-~])'                     # ESC, not P[X]^_
+    '|([\x00-\x1f\x7f-\x9f])'                               # any other
+)
+
+
+class Token:
+    ''' Base of the tokens, compared and shown by their fields. '''
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return (type(other) is type(self) and
+                all(getattr(self, name) == getattr(other, name)
+                    for name in self.__slots__))
+
+    def __repr__(self):
+        fields = ', '.join(f'{name}={getattr(self, name)!r}'
+                           for name in self.__slots__)
+        return f'{self.__class__.__name__}({fields})'
+
+
+class Text(Token):
+    ''' A run of printable text. '''
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class Control(Token):
+    ''' A C0 or C1 control character to execute, e.g. newline. '''
+    __slots__ = ('char',)
+
+    def __init__(self, char):
+        self.char = char
+
+
+class Escape(Token):
+    ''' An escape sequence, e.g. "ESC 7" or "ESC ( B". '''
+    __slots__ = ('intermediates', 'final')
+
+    def __init__(self, intermediates, final):
+        self.intermediates = intermediates
+        self.final = final
+
+
+class CSI(Token):
+    ''' A control sequence, its parameters parsed to ints, None when
+        omitted, or tuples of colon separated sub-parameters.
+    '''
+    __slots__ = ('private', 'params', 'intermediates', 'final')
+
+    def __init__(self, private, params, intermediates, final):
+        self.private = private
+        self.params = params
+        self.intermediates = intermediates
+        self.final = final
+
+    @property
+    def is_sgr(self):
+        ''' Whether this sets graphic rendition, i.e.: styles. '''
+        return self.final == 'm' and not (self.private or self.intermediates)
+
+
+class OSC(Token):
+    ''' An operating system command, e.g. to set the title. '''
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class DCS(Token):
+    ''' A device control string. '''
+    __slots__ = ('private', 'params', 'intermediates', 'final', 'data')
+
+    def __init__(self, private, params, intermediates, final, data):
+        self.private = private
+        self.params = params
+        self.intermediates = intermediates
+        self.final = final
+        self.data = data
+
+
+class String(Token):
+    ''' A SOS, PM, or APC string, kind is one of those. '''
+    __slots__ = ('kind', 'data')
+
+    def __init__(self, kind, data):
+        self.kind = kind
+        self.data = data
+
+
+@lru_cache(maxsize=256)    # output repeats the same few, mostly
+def parse_params(params):
+    ''' Parse a parameter string, e.g.: "1;;38:2::1:2:3", to:
+        (1, None, (38, 2, None, 1, 2, 3))
+    '''
+    if not params:
+        return ()
+    return tuple((tuple(int(sub) if sub else None
+                        for sub in param.split(':'))
+                  if ':' in param else int(param) if param else None)
+                 for param in params.split(';'))
+
+
+class Parser:
+    ''' Parses text incrementally, fed in chunks of any size.
+
+        Text runs are emitted as found, so may be split at chunk ends,
+        sequences are held until complete.
+    '''
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        ''' Return to the ground state, dropping a partial sequence. '''
+        self.state = GROUND
+        self._private = self._params = self._intermediates = ''
+        self._final = ''
+        self._data = []
+        self._kind = None           # of string
+        self._after_string = False  # so ESC \ ends it quietly
+
+    def feed(self, text):
+        ''' Parse a chunk of text, returning a list of tokens. '''
+        tokens = []
+        append = tokens.append
+        pos = 0
+        length = len(text)
+        while pos < length:
+            if self.state != GROUND:  # step by char, until done
+                self._step(text[pos], append)
+                pos += 1
+                continue
+
+            for match in _token_finder.finditer(text, pos):  # back to back
+                group = match.lastindex
+                if group == 1:
+                    append(Text(match.group(1)))
+                elif group == 5:
+                    private, params, intermediates, final = match.group(
+                        2, 3, 4, 5)
+                    append(CSI(private, parse_params(params), intermediates,
+                               final))
+                elif group == 6:
+                    append(OSC(match.group(6)))
+                elif group == 8:
+                    append(Escape(match.group(7), match.group(8)))
+                else:  # a control, or the start of something odd
+                    self._step(match.group(9), append)
+                    if self.state != GROUND:
+                        pos = match.end()
+                        break
+            else:
+                break
+        return tokens
+
+    def flush(self):
+        ''' End of input, a sequence left unfinished is dropped. '''
+        self.reset()
+        return []
+
+    def _enter(self, state):
+        self.state = state
+        if state in (ESCAPE, CSI_ENTRY, DCS_ENTRY):   # clear
+            self._private = self._params = self._intermediates = ''
+        elif state in _STRING_STATES:
+            self._data = []
+
+    def _end_string(self, append):
+        ''' Emit the string of the state being left. '''
+        data = ''.join(self._data)
+        state = self.state
+        if state == OSC_STRING:
+            append(OSC(data))
+        elif state == DCS_PASSTHROUGH:
+            append(DCS(self._private, parse_params(self._params),
+                       self._intermediates, self._final, data))
+        else:
+            append(String(self._kind, data))
+
+    def _step(self, char, append):
+        ''' Advance the state machine by one character. '''
+        state = self.state
+        code = ord(char)
+
+        # transitions from anywhere:
+        if code == 0x1b or 0x80 <= code <= 0x9f or code in (0x18, 0x1a):
+            if state in _STRING_STATES:
+                self._end_string(append)
+                if code == 0x1b:  # perhaps ST, see below
+                    self._enter(ESCAPE)
+                    self._after_string = True
+                    return
+            if code == 0x1b:
+                self._enter(ESCAPE)
+            elif code == 0x9b:
+                self._enter(CSI_ENTRY)
+            elif code == 0x9d:
+                self._enter(OSC_STRING)
+            elif code == 0x90:
+                self._enter(DCS_ENTRY)
+            elif code in (0x98, 0x9e, 0x9f):
+                self._kind = _STRING_KINDS[char]
+                self._enter(SOS_PM_APC_STRING)
+            else:
+                if code != 0x9c:   # ST ends strings only
+                    append(Control(char))
+                self._enter(GROUND)
+            self._after_string = False
+            return
+
+        if state == GROUND:
+            if code < 0x20:
+                append(Control(char))
+            elif code != 0x7f:
+                append(Text(char))
+
+        elif state == ESCAPE or state == ESCAPE_INTERMEDIATE:
+            if code < 0x20:
+                append(Control(char))
+            elif code <= 0x2f:
+                self._intermediates += char
+                self.state = ESCAPE_INTERMEDIATE
+            elif code == 0x7f:
+                pass
+            elif state == ESCAPE and char == '[':
+                self._enter(CSI_ENTRY)
+            elif state == ESCAPE and char == ']':
+                self._enter(OSC_STRING)
+            elif state == ESCAPE and char == 'P':
+                self._enter(DCS_ENTRY)
+            elif state == ESCAPE and char in 'X^_':
+                self._kind = _STRING_KINDS[char]
+                self._enter(SOS_PM_APC_STRING)
+            else:
+                if not (char == '\\' and self._after_string):  # not ST
+                    append(Escape(self._intermediates, char))
+                self._enter(GROUND)
+            self._after_string = False
+
+        elif state in (CSI_ENTRY, CSI_PARAM, CSI_INTERMEDIATE, CSI_IGNORE):
+            if code < 0x20:
+                append(Control(char))
+            elif code == 0x7f:
+                pass
+            elif state == CSI_IGNORE:
+                if 0x40 <= code <= 0x7e:
+                    self._enter(GROUND)
+            elif code <= 0x2f:
+                self._intermediates += char
+                self.state = CSI_INTERMEDIATE
+            elif code <= 0x3f:
+                if state == CSI_INTERMEDIATE:
+                    self.state = CSI_IGNORE
+                elif char in '<=>?':
+                    if state == CSI_ENTRY:
+                        self._private = char
+                        self.state = CSI_PARAM
+                    else:
+                        self.state = CSI_IGNORE
+                else:
+                    self._params += char
+                    self.state = CSI_PARAM
+            else:
+                append(CSI(self._private, parse_params(self._params),
+                           self._intermediates, char))
+                self._enter(GROUND)
+
+        elif state in (DCS_ENTRY, DCS_PARAM, DCS_INTERMEDIATE, DCS_IGNORE):
+            if code < 0x20 or code == 0x7f or state == DCS_IGNORE:
+                pass
+            elif code <= 0x2f:
+                self._intermediates += char
+                self.state = DCS_INTERMEDIATE
+            elif code <= 0x3f:
+                if state == DCS_INTERMEDIATE:
+                    self.state = DCS_IGNORE
+                elif char in '<=>?':
+                    if state == DCS_ENTRY:
+                        self._private = char
+                        self.state = DCS_PARAM
+                    else:
+                        self.state = DCS_IGNORE
+                else:
+                    self._params += char
+                    self.state = DCS_PARAM
+            else:
+                self._final = char
+                self._enter(DCS_PASSTHROUGH)
+
+        elif state == OSC_STRING:
+            if code == 0x07:  # xterm allows BEL to end it
+                self._end_string(append)
+                self._enter(GROUND)
+            elif code >= 0x20 and code != 0x7f:
+                self._data.append(char)
+
+        else:  # DCS_PASSTHROUGH, SOS_PM_APC_STRING
+            if code != 0x7f:
+                self._data.append(char)
+
+
+def parse(text):
+    ''' Parse a complete text, yielding tokens. '''
+    parser = Parser()
+    yield from parser.feed(text)
@@ -1,3 +1,4 @@
+# -*- coding: future_fstrings -*-
 '''
     .. console - Comprehensive utility library for ANSI terminals.
     .. © 2018, Mike Miller - ADDITIONAL PORTIONS released under the LGPL 3+.
@@ -23,13 +24,49 @@
 
         :copyright: Copyright 2006-2017 by the Pygments team, see AUTHORS.
         :license: BSD, see LICENSE for details.
+
+    Lookups against the built tables are sped up by computing the nearest
+    entries of the xterm color cube and grey ramp directly,
+    or by a precomputed table of candidates, see ``build_lookup_table``.
+    Whole arrays of colors may be converted at once with
+    ``find_nearest_color_indexes``, faster when NumPy is installed.
+
+    Besides the default Euclidean RGB distance, the perceptual "redmean",
+    CIELAB ΔE 1976 and ΔE 2000 metrics are available via the ``method``
+    argument, see ``METHODS``.
 '''
+import hashlib
+import logging
+import os
+import sys
+from array import array
+from math import atan2, cos, degrees, exp, hypot, radians, sin, sqrt
+
+import env
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 from . import color_tables
 
 
+log = logging.getLogger(__name__)
+
 color_table4 = []   # 16 colors
 color_table8 = []   # 265 colors
 
+LUT_BITS = 4        # per channel, i.e. a 16x16x16 grid of cells
+_LUT_SHIFT = 8 - LUT_BITS
+_LUT_VERSION = 1    # bump when the cache file format changes
+_lookup_tables = {} # id(color_table): (offsets, candidates)
+_lab_tables = {}    # id(color_table): [(L, a, b), …]
+
+METHODS = ('euclid', 'redmean', 'cie76', 'ciede2000')
+
+
+_CUBE_VALUES = (0x00, 0x5f, 0x87, 0xaf, 0xd7, 0xff)
+
 
 def _build_color_table(base, extended=True):
     # start with first 16 colors
@@ -38,7 +75,7 @@ def _build_color_table(base, extended=True):
 
     if extended:
         # colors 16..232: the 6x6x6 color cube
-        valuerange = (0x00, 0x5f, 0x87, 0xaf, 0xd7, 0xff)
+        valuerange = _CUBE_VALUES
 
         for i in range(217):
             r = valuerange[(i // 36) % 6]
@@ -73,6 +110,424 @@ def build_color_tables(base=color_tables.vga_palette4):
         color_table8.clear()
         color_table8.extend(table8)
 
+    _lookup_tables.clear()  # stale now, rebuilt lazily
+    _lab_tables.clear()
+
+
+def _get_cache_filename(color_table, cache_dir):
+    ''' Name the cache file after the palette it was built from. '''
+    key = repr((_LUT_VERSION, LUT_BITS, sys.byteorder,
+                [tuple(values) for values in color_table]))
+    digest = hashlib.sha1(key.encode('utf8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f'console-lut-{digest}.bin')
+
+
+def _load_lookup_table(filename):
+    ''' Read a table written by _save_lookup_table, or return None. '''
+    offsets = array('I')
+    try:
+        with open(filename, 'rb') as infile:
+            offsets.fromfile(infile, (1 << (LUT_BITS * 3)) + 1)
+            candidates = infile.read()
+    except (OSError, EOFError) as err:
+        log.debug('lookup table not loaded: %s', err)
+        return None
+
+    if len(candidates) != offsets[-1]:  # truncated, ignore
+        return None
+    return offsets, candidates
+
+
+def _save_lookup_table(filename, table):
+    offsets, candidates = table
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmpname = f'{filename}.{os.getpid()}'
+        with open(tmpname, 'wb') as outfile:
+            offsets.tofile(outfile)
+            outfile.write(candidates)
+        os.replace(tmpname, filename)  # atomic, avoid partial reads
+    except OSError as err:
+        log.debug('lookup table not saved: %s', err)
+
+
+def build_lookup_table(color_table, cache_dir=None):
+    ''' Precompute the nearest-color candidates for a color table.
+
+        The RGB cube is divided into a grid of cells, ``LUT_BITS`` per
+        channel.  For each cell, the indexes of all palette entries that could
+        be nearest to any color inside it are saved.  A lookup then needs to
+        compare only a handful of entries instead of the whole table, and
+        returns exactly the same index as a full scan.
+
+        Arguments:
+            color_table:    sequence of (r, g, b) int tuples, 256 max.
+            cache_dir:      str - if given, the table is loaded from or saved
+                            to a file in this folder, keyed by the palette.
+
+        Returns:
+            tuple: (offsets, candidates) - array of cell start positions,
+                   bytes of candidate indexes.
+    '''
+    filename = None
+    if cache_dir:
+        filename = _get_cache_filename(color_table, cache_dir)
+        table = _load_lookup_table(filename)
+        if table:
+            return table
+
+    cells = 1 << LUT_BITS
+    width = 1 << _LUT_SHIFT
+
+    # per channel & cell, the min & max squared distance to each entry:
+    near = ([], [], [])
+    far = ([], [], [])
+    for chan in range(3):
+        values = [entry[chan] for entry in color_table]
+        for cell in range(cells):
+            lo = cell * width
+            hi = lo + width - 1
+            near[chan].append([
+                (lo - v) ** 2 if v < lo else (v - hi) ** 2 if v > hi else 0
+                for v in values
+            ])
+            far[chan].append([max(v - lo, hi - v) ** 2 for v in values])
+
+    offsets = array('I', (0,))
+    candidates = bytearray()
+    for rcell in range(cells):
+        for gcell in range(cells):
+            for bcell in range(cells):
+                dmin = [r + g + b for r, g, b in zip(near[0][rcell],
+                                                     near[1][gcell],
+                                                     near[2][bcell])]
+                dmax = [r + g + b for r, g, b in zip(far[0][rcell],
+                                                     far[1][gcell],
+                                                     far[2][bcell])]
+                # entries farther than the closest "worst case" can't win:
+                limit = min(dmax)
+                candidates.extend(i for i, dist in enumerate(dmin)
+                                  if dist <= limit)
+                offsets.append(len(candidates))
+
+    table = offsets, bytes(candidates)
+    if filename:
+        _save_lookup_table(filename, table)
+    return table
+
+
+def _get_lookup_table(color_table):
+    ''' Return the lookup table for one of the module color tables,
+        building it on first use.
+    '''
+    table = _lookup_tables.get(id(color_table))
+    if table is None:
+        table = build_lookup_table(color_table,
+                                   cache_dir=env.PY_CONSOLE_CACHE_DIR or None)
+        _lookup_tables[id(color_table)] = table
+    return table
+
+
+def _cube_step(value):
+    ''' Snap a channel value to the nearest step of the color cube,
+        the lower one on a tie.  Midpoints: 47.5, 115, 155, 195, 235.
+    '''
+    if value < 48:
+        return 0
+    step = 1 + (value - 76) // 40
+    return 1 if step < 1 else 5 if step > 5 else step
+
+
+def _find_nearest_xterm(r, g, b, color_table):
+    ''' Closed-form search of a 256 color table as built above:
+        16 base colors, the 6x6x6 cube at 16, and the grey ramp at 233.
+
+        Returns the same index as a full scan, ties going to the lowest.
+    '''
+    # cube, nearest per channel:
+    ri, gi, bi = _cube_step(r), _cube_step(g), _cube_step(b)
+    rd = r - _CUBE_VALUES[ri]
+    gd = g - _CUBE_VALUES[gi]
+    bd = b - _CUBE_VALUES[bi]
+    shortest_distance = (rd * rd) + (gd * gd) + (bd * bd)
+    index = 16 + (36 * ri) + (6 * gi) + bi
+
+    # grey ramp, nearest to the mean of the channels, 18…238 by 10.
+    # 232 duplicates the cube's black at 16, so is skipped:
+    step = (r + g + b - 10) // 30
+    step = 1 if step < 1 else 23 if step > 23 else step
+    value = 8 + step * 10
+    rd = r - value
+    gd = g - value
+    bd = b - value
+    this_distance = (rd * rd) + (gd * gd) + (bd * bd)
+    if this_distance < shortest_distance:
+        index = 232 + step
+        shortest_distance = this_distance
+
+    # base colors come first, so win ties:
+    for i in range(16):
+        values = color_table[i]
+        rd = r - values[0]
+        gd = g - values[1]
+        bd = b - values[2]
+
+        this_distance = (rd * rd) + (gd * gd) + (bd * bd)
+
+        if this_distance <= shortest_distance:
+            if this_distance < shortest_distance or i < index:
+                index = i
+                shortest_distance = this_distance
+
+    return index
+
+
+def _find_nearest_in(r, g, b, color_table, indexes):
+    ''' Euclidean scan over a subset of a color table.  Ties go to the first,
+        i.e. lowest index.
+    '''
+    shortest_distance = 257*257*3  # max eucl. distance from #000000 to #ffffff
+    index = 0                      # default to black
+
+    for i in indexes:
+        values = color_table[i]
+        rd = r - values[0]
+        gd = g - values[1]
+        bd = b - values[2]
+
+        this_distance = (rd * rd) + (gd * gd) + (bd * bd)
+
+        if this_distance < shortest_distance:  # closer
+            index = i
+            shortest_distance = this_distance
+
+    return index
+
+
+def _srgb_to_linear(value):
+    value /= 255
+    if value <= 0.04045:
+        return value / 12.92
+    return ((value + 0.055) / 1.055) ** 2.4
+
+
+def _lab_f(t):
+    if t > 216 / 24389:
+        return t ** (1 / 3)
+    return (24389 / 27 * t + 16) / 116
+
+
+def rgb_to_lab(r, g, b):
+    ''' Convert an sRGB color to CIELAB, D65 white point.
+
+        Arguments:
+            r, g, b:    int - of range 0…255
+
+        Returns:
+            tuple: (L, a, b) floats
+    '''
+    r, g, b = _srgb_to_linear(r), _srgb_to_linear(g), _srgb_to_linear(b)
+    x = (0.4124564 * r + 0.3575761 * g + 0.1804375 * b) / 0.95047
+    y = (0.2126729 * r + 0.7151522 * g + 0.0721750 * b)
+    z = (0.0193339 * r + 0.1191920 * g + 0.9503041 * b) / 1.08883
+
+    fx, fy, fz = _lab_f(x), _lab_f(y), _lab_f(z)
+    return (116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz))
+
+
+def _get_lab_table(color_table):
+    ''' Return Lab coordinates for a color table, saved for the module tables
+        as they are used repeatedly.
+    '''
+    if isinstance(color_table, ColorTable):
+        return color_table.lab
+    is_module_table = (color_table is color_table8 or
+                       color_table is color_table4)
+    table = _lab_tables.get(id(color_table)) if is_module_table else None
+    if table is None:
+        table = [rgb_to_lab(*values[:3]) for values in color_table]
+        if is_module_table:
+            _lab_tables[id(color_table)] = table
+    return table
+
+
+def _delta_e2000(lab1, lab2):
+    ''' CIEDE2000 color difference, after Sharma, Wu, Dalal (2005). '''
+    L1, a1, b1 = lab1
+    L2, a2, b2 = lab2
+
+    mean_c7 = ((hypot(a1, b1) + hypot(a2, b2)) / 2) ** 7
+    g = 0.5 * (1 - sqrt(mean_c7 / (mean_c7 + 25 ** 7)))
+    a1 *= 1 + g
+    a2 *= 1 + g
+    c1 = hypot(a1, b1)
+    c2 = hypot(a2, b2)
+    h1 = degrees(atan2(b1, a1)) % 360 if c1 else 0
+    h2 = degrees(atan2(b2, a2)) % 360 if c2 else 0
+
+    dh = 0
+    mean_h = h1 + h2
+    if c1 and c2:
+        dh = h2 - h1
+        if dh > 180:
+            dh -= 360
+        elif dh < -180:
+            dh += 360
+
+        if abs(h1 - h2) <= 180:
+            mean_h /= 2
+        elif mean_h < 360:
+            mean_h = (mean_h + 360) / 2
+        else:
+            mean_h = (mean_h - 360) / 2
+
+    dl = L2 - L1
+    dc = c2 - c1
+    dh = 2 * sqrt(c1 * c2) * sin(radians(dh) / 2)
+
+    mean_l = (L1 + L2) / 2 - 50
+    mean_c = (c1 + c2) / 2
+    mean_c7 = mean_c ** 7
+    t = (1 - 0.17 * cos(radians(mean_h - 30))
+           + 0.24 * cos(radians(2 * mean_h))
+           + 0.32 * cos(radians(3 * mean_h + 6))
+           - 0.20 * cos(radians(4 * mean_h - 63)))
+    rotation = (-2 * sqrt(mean_c7 / (mean_c7 + 25 ** 7)) *
+                sin(radians(60 * exp(-((mean_h - 275) / 25) ** 2))))
+
+    dl /= 1 + 0.015 * mean_l ** 2 / sqrt(20 + mean_l ** 2)
+    dc /= 1 + 0.045 * mean_c
+    dh /= 1 + 0.015 * mean_c * t
+    return sqrt(dl * dl + dc * dc + dh * dh + rotation * dc * dh)
+
+
+def _find_nearest_perceptual(r, g, b, color_table, method):
+    ''' Scan a color table with one of the perceptual metrics.
+        Ties go to the first, i.e. lowest index.
+    '''
+    shortest_distance = float('inf')
+    index = 0
+
+    if method == 'redmean':  # weighted RGB, no conversion needed
+        for i, values in enumerate(color_table):
+            rsum = r + values[0]  # 2 * mean red, weights scaled by 512:
+            rd = r - values[0]
+            gd = g - values[1]
+            bd = b - values[2]
+            this_distance = ((1024 + rsum) * rd * rd + 2048 * gd * gd +
+                             (1534 - rsum) * bd * bd)
+            if this_distance < shortest_distance:
+                index = i
+                shortest_distance = this_distance
+
+    elif method == 'cie76':  # Euclidean in Lab space
+        L, A, B = rgb_to_lab(r, g, b)
+        for i, values in enumerate(_get_lab_table(color_table)):
+            ld = L - values[0]
+            ad = A - values[1]
+            bd = B - values[2]
+            this_distance = (ld * ld) + (ad * ad) + (bd * bd)
+            if this_distance < shortest_distance:
+                index = i
+                shortest_distance = this_distance
+
+    elif method == 'ciede2000':
+        lab = rgb_to_lab(r, g, b)
+        for i, values in enumerate(_get_lab_table(color_table)):
+            this_distance = _delta_e2000(lab, values)
+            if this_distance < shortest_distance:
+                index = i
+                shortest_distance = this_distance
+
+    else:
+        raise ValueError(f'{method!r} is not one of {METHODS}.')
+
+    return index
+
+
+class ColorTable(tuple):
+    ''' A color table for large, custom palettes,
+        that finds nearest colors in logarithmic time.
+
+        A k-d tree of the entries is built once on creation.
+        May be passed anywhere a color table is accepted,
+        results are the same as a scan of the table.
+
+        Arguments:
+            colors:     sequence of (r, g, b) int tuples
+
+        Example::
+
+            brand = ColorTable(((0x12, 0x34, 0x56), …))
+            index = find_nearest_color_index(1, 2, 3, color_table=brand)
+    '''
+    def __new__(cls, colors=()):
+        self = tuple.__new__(cls, (tuple(values[:3]) for values in colors))
+        self._root = self._build_tree(list(range(len(self))), 0)
+        self._lab = None
+        return self
+
+    def _build_tree(self, indexes, depth):
+        ''' Node: (index, axis, split value, left node, right node) '''
+        if not indexes:
+            return None
+
+        axis = depth % 3
+        indexes.sort(key=lambda i: self[i][axis])
+        middle = len(indexes) // 2
+        index = indexes[middle]
+        return (index, axis, self[index][axis],
+                self._build_tree(indexes[:middle], depth + 1),
+                self._build_tree(indexes[middle + 1:], depth + 1))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({tuple(self)!r})'
+
+    @property
+    def lab(self):
+        ''' Lab coordinates of the entries, computed on first use. '''
+        if self._lab is None:
+            self._lab = [rgb_to_lab(*values) for values in self]
+        return self._lab
+
+    def find_nearest_index(self, r, g, b):
+        ''' Given three integers representing R, G, and B,
+            return the nearest color index by Euclidean distance.
+
+            Ties go to the lowest index, as with a scan.
+        '''
+        target = (r, g, b)
+        shortest_distance = 257*257*3
+        index = 0
+        stack = [(self._root, 0)]  # node, min distance to its region
+
+        while stack:
+            node, bound = stack.pop()
+            if node is None or bound > shortest_distance:
+                continue
+
+            i, axis, split, left, right = node
+            values = self[i]
+            rd = r - values[0]
+            gd = g - values[1]
+            bd = b - values[2]
+
+            this_distance = (rd * rd) + (gd * gd) + (bd * bd)
+            if this_distance < shortest_distance or (
+               this_distance == shortest_distance and i < index):
+                index = i
+                shortest_distance = this_distance
+
+            diff = target[axis] - split
+            if diff < 0:
+                stack.append((right, diff * diff))
+                stack.append((left, 0))     # nearer side is popped first
+            else:
+                stack.append((left, diff * diff))
+                stack.append((right, 0))
+
+        return index
+
 
 def find_nearest_color_index(r, g, b, color_table=None, method='euclid'):
     ''' Given three integers representing R, G, and B,
@@ -82,29 +537,42 @@ def find_nearest_color_index(r, g, b, color_table=None, method='euclid'):
             r:    int - of range 0…255
             g:    int - of range 0…255
             b:    int - of range 0…255
+            color_table: defaults to color_table8
+            method: str - distance metric, one of METHODS
 
         Returns:
             int, None: index, or None on error.
+
+        Note:
+            The extended module color table is searched analytically,
+            the basic via a lookup table, a ColorTable via its tree,
+            and others with a full scan.
     '''
-    shortest_distance = 257*257*3  # max eucl. distance from #000000 to #ffffff
-    index = 0                      # default to black
     if not color_table:
         if not color_table8:
             build_color_tables()
         color_table = color_table8
 
-    for i, values in enumerate(color_table):
-        rd = r - values[0]
-        gd = g - values[1]
-        bd = b - values[2]
+    if method != 'euclid':
+        return _find_nearest_perceptual(r, g, b, color_table, method)
 
-        this_distance = (rd * rd) + (gd * gd) + (bd * bd)
+    if isinstance(color_table, ColorTable):
+        return color_table.find_nearest_index(r, g, b)
 
-        if this_distance < shortest_distance:  # closer
-            index = i
-            shortest_distance = this_distance
+    if color_table is color_table8 and len(color_table) == 256:
+        return _find_nearest_xterm(r, g, b, color_table)
 
-    return index
+    if ((color_table is color_table8 or color_table is color_table4)
+            and 0 <= r < 256 and 0 <= g < 256 and 0 <= b < 256):
+        offsets, candidates = _get_lookup_table(color_table)
+        cell = ((int(r) >> _LUT_SHIFT) << (LUT_BITS * 2) |
+                (int(g) >> _LUT_SHIFT) << LUT_BITS |
+                (int(b) >> _LUT_SHIFT))
+        indexes = candidates[offsets[cell]:offsets[cell+1]]
+    else:
+        indexes = range(len(color_table))
+
+    return _find_nearest_in(r, g, b, color_table, indexes)
 
 
 def find_nearest_color_hexstr(hexdigits, color_table=None, method='euclid'):
@@ -133,3 +601,105 @@ def find_nearest_color_hexstr(hexdigits, color_table=None, method='euclid'):
     return find_nearest_color_index(*triplet,
                                     color_table=color_table,
                                     method=method)
+
+
+def find_nearest_color_indexes(colors, color_table=None, method='euclid'):
+    ''' Given many colors, return the nearest color index for each, e.g. to
+        convert an image or heatmap at once.
+
+        Arguments:
+            colors:     an (N, 3) uint8 NumPy array,
+                        or an object supporting the buffer protocol
+                        holding packed bytes: r, g, b, r, g, b…
+            color_table: defaults to color_table8, also color_table4, etc.
+            method: str - distance metric, one of METHODS
+
+        Returns:
+            numpy.ndarray, array.array: of N indexes,
+                an ndarray when NumPy is installed.
+                The vectorized path is used for the 'euclid' method only.
+    '''
+    if not color_table:
+        if not color_table8:
+            build_color_tables()
+        color_table = color_table8
+
+    if numpy and method == 'euclid':
+        return _find_nearest_indexes_numpy(colors, color_table)
+
+    try:
+        data = memoryview(colors).cast('B')
+    except TypeError:  # not a buffer, sequence of triplets
+        data = bytes(value for triplet in colors for value in triplet)
+
+    if len(data) % 3:
+        raise ValueError(f'length {len(data)} is not a multiple of three.')
+
+    results = array('B' if len(color_table) <= 256 else 'H')
+    cache = {}  # images tend to repeat colors
+    for i in range(0, len(data), 3):
+        r, g, b = data[i:i+3]
+        key = (r << 16) | (g << 8) | b
+        index = cache.get(key)
+        if index is None:
+            index = cache[key] = find_nearest_color_index(
+                r, g, b, color_table=color_table, method=method)
+        results.append(index)
+
+    return numpy.array(results) if numpy else results
+
+
+def _find_nearest_indexes_numpy(colors, color_table, chunk_size=4096):
+    ''' Vectorized scan, ties go to the lowest index as with the loop. '''
+    if isinstance(colors, numpy.ndarray):
+        pixels = colors.reshape(-1, 3)
+    else:
+        try:
+            pixels = numpy.frombuffer(colors, dtype=numpy.uint8)
+        except TypeError:  # not a buffer, sequence of triplets
+            pixels = numpy.array(colors, dtype=numpy.uint8)
+        pixels = pixels.reshape(-1, 3)
+
+    # convert each unique color only once:
+    packed = ((pixels[:, 0].astype(numpy.int32) << 16) |
+              (pixels[:, 1].astype(numpy.int32) << 8) |
+               pixels[:, 2].astype(numpy.int32))
+    uniques, inverse = numpy.unique(packed, return_inverse=True)
+    uniq_rgb = numpy.stack(((uniques >> 16) & 0xff,
+                            (uniques >> 8) & 0xff,
+                             uniques & 0xff), axis=1)
+
+    table = numpy.array([tuple(values[:3]) for values in color_table],
+                        dtype=numpy.int32)
+    dtype = numpy.uint8 if len(color_table) <= 256 else numpy.intp
+    nearest = numpy.empty(len(uniques), dtype=dtype)
+
+    if color_table is color_table8 or color_table is color_table4:
+        # gather each cell's candidates from the lookup table, padded with
+        # its last one to make a rectangle, duplicates don't affect argmin:
+        offsets, candidates = _get_lookup_table(color_table)
+        offsets = numpy.array(offsets, dtype=numpy.intp)
+        counts = numpy.diff(offsets)
+        positions = offsets[:-1, None] + numpy.minimum(
+                        numpy.arange(counts.max()), counts[:, None] - 1)
+        indexes = numpy.frombuffer(candidates, dtype=numpy.uint8)[positions]
+
+        cells = (((uniq_rgb[:, 0] >> _LUT_SHIFT) << (LUT_BITS * 2)) |
+                 ((uniq_rgb[:, 1] >> _LUT_SHIFT) << LUT_BITS) |
+                  (uniq_rgb[:, 2] >> _LUT_SHIFT))
+    else:
+        indexes = None
+
+    for start in range(0, len(uniques), chunk_size):  # bound memory use
+        chunk = uniq_rgb[start:start + chunk_size]
+        if indexes is None:  # compare with all entries
+            distances = ((chunk[:, None, :] - table[None, :, :]) ** 2
+                         ).sum(axis=2)
+            nearest[start:start + chunk_size] = distances.argmin(axis=1)
+        else:
+            choices = indexes[cells[start:start + chunk_size]]
+            distances = ((chunk[:, None, :] - table[choices]) ** 2).sum(axis=2)
+            nearest[start:start + chunk_size] = choices[
+                numpy.arange(len(chunk)), distances.argmin(axis=1)]
+
+    return nearest[inverse.reshape(-1)]
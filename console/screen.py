@@ -25,7 +25,13 @@ from contextlib import contextmanager
 
 from . import _CHOSEN_PALETTE
 from .constants import CSI, ESC
+from .core import RenderInfo, SGRRenderer
 from .disabled import empty_bin
+from .output import batch, get_output
+
+
+MAX_CACHED_SEQUENCES = 1024  # rendered per template, e.g. moves to x, y
+MAX_REDRAW_GAP = 6          # unchanged cells rewritten rather than moved over
 
 
 class _TemplateString(str):
@@ -35,10 +41,23 @@ class _TemplateString(str):
     def __new__(cls, endcode, arg='%d'):
         self = str.__new__(cls, CSI + arg + endcode)
         self.endcode = endcode
+        self._rendered = {}     # args: sequence
         return self
 
     def __call__(self, *args):
-        return self % args
+        rendered = self._rendered
+        try:
+            return rendered[args]
+        except KeyError:
+            pass
+        text = self % args
+        if len(rendered) >= MAX_CACHED_SEQUENCES:  # drop oldest
+            try:    # shared by threads, as re's cache
+                rendered.pop(next(iter(rendered), None), None)
+            except (RuntimeError, StopIteration):
+                pass
+        rendered[args] = text
+        return text
 
     def __str__(self):
         try:
@@ -47,6 +66,45 @@ class _TemplateString(str):
             return self
 
 
+class _TemplateAttribute:
+    ''' Stands in for a sequence attribute of the Screen class, returning its
+        rendered template from instances, and the original from the class.
+    '''
+    __slots__ = ('name', 'value', 'template')
+
+    def __init__(self, name, value, template):
+        self.name = name
+        self.value = value
+        self.template = template
+
+    def __get__(self, screen, cls=None):
+        if screen is None:
+            return self.value
+        screen.__dict__[self.name] = self.template  # found directly next time
+        return self.template
+
+
+class _Frame:
+    ''' Collects the output of a frame, see Screen.frame. '''
+    __slots__ = ('screen', 'write')
+
+    def __init__(self, screen, writer):
+        self.screen = screen
+        self.write = writer.write
+
+    def move(self, x, y):
+        ''' Move the cursor to column x, row y, one-based. '''
+        self.write(self.screen.mv(y, x))
+
+    def erase(self, mode=2):
+        ''' Erase the screen, see utils.clear_screen for modes. '''
+        self.write(self.screen.erase(mode))
+
+    def erase_line(self, mode=2):
+        ''' Erase the line, see utils.clear_line for modes. '''
+        self.write(self.screen.erase_line(mode))
+
+
 class Screen:
     ''' Convenience class for cursor and screen manipulation.
 
@@ -96,7 +154,7 @@ class Screen:
     alt_screen_enable = ason = CSI + '?1049h'
     alt_screen_disable = asoff = CSI + '?1049l'
 
-    def __new__(cls, force=False):
+    def __new__(cls, force=False, **kwargs):
         ''' Override new() to replace the class entirely on deactivation.
 
             Complies with palette detection, unless force is on:
@@ -114,18 +172,33 @@ class Screen:
 
     def __init__(self, stream=sys.stdout, **kwargs):
         self._stream = stream
-        # look for attributes to wrap in a _TemplateString:
-        for name in dir(self):
-            if not name.startswith('_'):
-                value = getattr(self, name)
-
-                if type(value) is str and not value.startswith(ESC):
-                    attr = _TemplateString(value)
-                    setattr(self, name, attr)
-
-                elif type(value) is tuple:
-                    attr = _TemplateString(*value)
-                    setattr(self, name, attr)
+        cls = type(self)
+        if '_templates' not in cls.__dict__:  # once per class
+            # look for attributes to wrap in a _TemplateString:
+            templates = {}
+            for name in dir(cls):
+                if not name.startswith('_'):
+                    value = getattr(cls, name)
+
+                    if type(value) is str and not value.startswith(ESC):
+                        templates[name] = _TemplateString(value)
+
+                    elif type(value) is tuple:
+                        templates[name] = _TemplateString(*value)
+
+            for name, template in templates.items():
+                setattr(cls, name,
+                        _TemplateAttribute(name, getattr(cls, name), template))
+            cls._templates = templates  # set last for threads
+
+    @property
+    def _stream(self):
+        ''' The stream to write to, or the batch open on it. '''
+        return get_output(self._output)
+
+    @_stream.setter
+    def _stream(self, stream):
+        self._output = stream
 
     def __enter__(self):
         ''' Go full-screen. '''
@@ -185,6 +258,25 @@ class Screen:
             self._stream.write(str(self.restore_title(0)))  # 0 = icon & title
             self._stream.flush()
 
+    @contextmanager
+    def frame(self):
+        ''' Context Manager that collects moves, erases, and text, written
+            out at once on exit.
+
+            ::
+
+                with screen.frame() as frame:
+                    frame.move(1, 1)
+                    frame.erase_line()
+                    frame.write('Hello, world!')
+                    print('…and more.')
+
+            Output to the screen's stream during the frame is collected
+            too, see console.batch.
+        '''
+        with batch(self._output) as writer:
+            yield _Frame(self, writer)
+
     @contextmanager
     def hidden_cursor(self):
         ''' Context Manager that hides the cursor and restores it on exit.
@@ -203,4 +295,282 @@ class Screen:
             self._stream.flush()
 
 
+def _counted(template, count):
+    ''' Render a sequence taking a count, leaving out a count of one. '''
+    return CSI + template.endcode if count == 1 else template(count)
+
+
+class CursorPlanner:
+    ''' Moves the cursor from where it is known to be with the shortest
+        sequence: a carriage return, relative moves, to a column and/or
+        row, or to an absolute position::
+
+            planner = CursorPlanner()
+            stream.write(planner.move(0, 5))
+            stream.write(text)
+            planner.advance(len(text))
+
+        Arguments:
+            screen          Screen for sequences, defaults to the console
+                            screen.
+
+        Positions are numbered from zero.  The position is None when
+        unknown, at first, and should be set so when text may have wrapped
+        at the right edge, the next move is then absolute.  Plans are
+        cached, and the bytes saved compared to absolute moves are
+        available from info().
+    '''
+    def __init__(self, screen=None):
+        if screen is None:
+            screen = globals()['screen']    # module instance, defined below
+        self.screen = screen
+        self.position = None    # (x, y), or None if unknown
+        self._plans = {}        # (position, x, y): (sequence, absolute)
+        self._naive = self._emitted = 0
+
+    def advance(self, count):
+        ''' Move the known position right, after writing count cells. '''
+        if self.position is not None:
+            x, y = self.position
+            self.position = (x + count, y)
+
+    def move(self, x, y):
+        ''' Return the shortest sequence to move the cursor to x, y. '''
+        position = self.position
+        if position == (x, y):
+            return ''
+        key = (position, x, y)
+        plan = self._plans.get(key)
+        if plan is None:
+            plan = self._plan(position, x, y)
+            plans = self._plans
+            if len(plans) >= MAX_CACHED_SEQUENCES:  # drop oldest
+                try:    # shared by threads, as re's cache
+                    plans.pop(next(iter(plans), None), None)
+                except (RuntimeError, StopIteration):
+                    pass
+            plans[key] = plan
+        sequence, absolute = plan
+        self._naive += absolute
+        self._emitted += len(sequence)
+        self.position = (x, y)
+        return sequence
+
+    def _plan(self, position, x, y):
+        ''' Return the shortest sequence, and the length of the absolute. '''
+        screen = self.screen
+        absolute = screen.mv(y + 1, x + 1)
+        candidates = [absolute]
+        if x == 0:      # parameters default to one
+            candidates.append(f'{CSI}{y + 1}H' if y else f'{CSI}H')
+
+        if position is not None:
+            old_x, old_y = position
+            if x == old_x:
+                horizontal = ''
+            elif x == 0:
+                horizontal = '\r'
+            else:
+                horizontal = min(
+                    _counted(screen.right, x - old_x) if x > old_x else
+                    _counted(screen.left, old_x - x),
+                    screen.mv_x(x + 1),
+                    key=len)
+            if y == old_y:
+                candidates.append(horizontal)
+            else:
+                candidates.append(horizontal + min(
+                    _counted(screen.down, y - old_y) if y > old_y else
+                    _counted(screen.up, old_y - y),
+                    screen.mv_y(y + 1),
+                    key=len))
+                line = (_counted(screen.next_line, y - old_y) if y > old_y
+                        else _counted(screen.prev_line, old_y - y))
+                if x:   # from the first column
+                    line += min(_counted(screen.right, x), screen.mv_x(x + 1),
+                                key=len)
+                candidates.append(line)
+
+        return min(candidates, key=len), len(absolute)
+
+    def info(self):
+        ''' Report the bytes of moves output, and those saved.
+
+            Returns:
+                RenderInfo: naive, emitted, saved
+        '''
+        return RenderInfo(self._naive, self._emitted,
+                          self._naive - self._emitted)
+
+
+class VirtualScreen:
+    ''' A grid of cells, each a character and its style, drawn off-screen
+        then presented, writing only the cells changed since last time::
+
+            view = VirtualScreen(80, 24)
+            view.put(0, 0, 'cpu', fx.bold)
+            view.put(4, 0, '42%', fg.green)
+            view.present()  # first time, all of it
+
+        Arguments:
+            width, height   Size in cells, e.g. from os.get_terminal_size.
+            screen          Screen for sequences and output, defaults to
+                            the console screen.
+
+        Cells are numbered from zero, like curses.  Styles are palette
+        entries, e.g. fg.red + fx.bold, or None for the default.  Each
+        character fills one cell, wide characters are not accounted for.
+        The view is expected to fill the terminal, scrolling the whole of
+        it when the content has moved up.  Cursor moves are planned, see
+        CursorPlanner.
+    '''
+    def __init__(self, width, height, screen=None):
+        if screen is None:
+            screen = globals()['screen']    # module instance, defined below
+        self.screen = screen
+        self.width = width
+        self.height = height
+        self._chars, self._styles = self._blank()   # back buffer, drawn to
+        self._front = None      # (chars, styles) presented, None to repaint
+        self._renderer = SGRRenderer()
+        self.planner = CursorPlanner(screen)
+
+    def _blank(self):
+        ''' Return rows of blank characters and styles. '''
+        width, height = self.width, self.height
+        return ([[' '] * width for _ in range(height)],
+                [[None] * width for _ in range(height)])
+
+    def put(self, x, y, text, style=None):
+        ''' Draw text at the given cell, clipped at the right edge.  Text
+            should be printable, without newlines or escape sequences.
+        '''
+        if not 0 <= y < self.height or not 0 <= x < self.width:
+            return
+        count = min(len(text), self.width - x)
+        self._chars[y][x:x + count] = text[:count]
+        self._styles[y][x:x + count] = [style] * count
+
+    def clear(self):
+        ''' Blank the drawing, to be drawn over for the next present. '''
+        self._chars, self._styles = self._blank()
+
+    def redraw(self):
+        ''' Repaint everything at the next present, e.g. after the terminal
+            was cleared elsewhere.
+        '''
+        self._front = None
+
+    def _find_scroll(self, front_chars, front_styles):
+        ''' Return how many rows the content moved up since last time, when
+            scrolling it is a win, else zero.
+        '''
+        chars, styles = self._chars, self._styles
+        height = self.height
+        if chars[0] == front_chars[0] and styles[0] == front_styles[0]:
+            return 0
+        in_place = sum(1 for y in range(height)
+                       if chars[y] == front_chars[y] and
+                       styles[y] == front_styles[y])
+        for count in range(1, height // 2 + 1):
+            if (chars[0] == front_chars[count] and
+                    styles[0] == front_styles[count]):
+                moved = sum(1 for y in range(height - count)
+                            if chars[y] == front_chars[y + count] and
+                            styles[y] == front_styles[y + count])
+                if moved > in_place and moved * 2 > height - count:
+                    return count
+        return 0
+
+    def _changed_runs(self, chars, styles, front_chars, front_styles):
+        ''' Return (start, end) ranges of changed cells in a row, joined
+            when they are close together.
+        '''
+        runs = []
+        start = end = None
+        for x in range(self.width):
+            if chars[x] != front_chars[x] or styles[x] is not front_styles[x]:
+                if start is None:
+                    start = x
+                elif x - end > MAX_REDRAW_GAP:
+                    runs.append((start, end + 1))
+                    start = x
+                end = x
+        if start is not None:
+            runs.append((start, end + 1))
+        return runs
+
+    def present(self):
+        ''' Write the changes since the last present, in one write.  The
+            terminal is left in its default style.
+
+            Returns the text written.
+        '''
+        screen = self.screen
+        renderer = self._renderer
+        planner = self.planner
+        width, height = self.width, self.height
+        output = []
+
+        if self._front is None:     # paint over everything
+            output.append(renderer.render((), finish=True))
+            output.append(screen.erase(2))
+            front_chars, front_styles = self._blank()
+            planner.position = None
+        else:
+            front_chars, front_styles = self._front
+            count = self._find_scroll(front_chars, front_styles)
+            if count:
+                output.append(renderer.render((), finish=True))  # blank bg
+                output.append(screen.scroll_up(count))
+                blank_chars, blank_styles = self._blank()
+                front_chars = front_chars[count:] + blank_chars[:count]
+                front_styles = front_styles[count:] + blank_styles[:count]
+
+        for y in range(height):
+            chars, styles = self._chars[y], self._styles[y]
+            if chars == front_chars[y] and styles == front_styles[y]:
+                continue
+
+            tail = width    # blank from here to the right edge
+            while tail and chars[tail - 1] == ' ' and not styles[tail - 1]:
+                tail -= 1
+
+            for start, end in self._changed_runs(chars, styles,
+                                                 front_chars[y],
+                                                 front_styles[y]):
+                output.append(planner.move(start, y))
+                erase = end > tail      # the rest, instead of spaces
+                if erase:
+                    end = tail
+                segments = []
+                x = start
+                while x < end:
+                    style = styles[x]
+                    run_end = x + 1
+                    while run_end < end and styles[run_end] is style:
+                        run_end += 1
+                    segments.append((style, ''.join(chars[x:run_end])))
+                    x = run_end
+                output.append(renderer.render(segments, finish=erase))
+                if erase:
+                    output.append(screen.erase_line(0))
+                    planner.position = (x, y)
+                    break
+                planner.position = (x, y) if x < width else None  # wrap
+
+            front_chars[y] = chars[:]
+            front_styles[y] = styles[:]
+
+        output.append(renderer.render((), finish=True))
+        self._front = (front_chars, front_styles)
+
+        text = ''.join(output)
+        if text:
+            stream = screen._stream
+            stream.write(text)
+            stream.flush()
+        return text
+
+
 screen = Screen()
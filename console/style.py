@@ -28,6 +28,9 @@ class ForegroundPalette(_HighColorPaletteBuilder):
                                   explicitly.  str, seq, or None
             x11_rgb_filename    - '/path/to/X11/rgb.txt',
                                   defaults to a platform dependent value.
+            downgrade_method    - Distance metric used to find the nearest
+                                  color, 'euclid' (default), 'redmean',
+                                  'cie76', or 'ciede2000'.
     '''
     default         = 39    # must be first :-D
 
@@ -67,6 +70,9 @@ class BackgroundPalette(_HighColorPaletteBuilder):
                                   explicitly.  str, seq, or None
             x11_rgb_filename    - '/path/to/X11/rgb.txt',
                                   defaults to a platform dependent value.
+            downgrade_method    - Distance metric used to find the nearest
+                                  color, 'euclid' (default), 'redmean',
+                                  'cie76', or 'ciede2000'.
     '''
     default         = 49
 
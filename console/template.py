@@ -0,0 +1,281 @@
+# -*- coding: future_fstrings -*-
+'''
+    .. console - Comprehensive utility library for ANSI terminals.
+    .. © 2018, Mike Miller - Released under the LGPL, version 3+.
+
+    Compiled style templates, for rendering many rows quickly.
+
+    A template is a format string, with palette entries referenced as
+    replacement fields, e.g.::
+
+        >>> tmpl = StyleTemplate('{fx.dim}{time}{fx.end} '
+        ...                      '{fg.red+fx.bold}{level:<5}{fx.end} {msg}')
+        >>> tmpl.render(time='12:00', level='ERROR', msg='Disk full.')
+        >>> tmpl.render_many(rows)  # one string for many rows
+
+    Styles are resolved once when compiled and joined to the literal text
+    around them, leaving only data fields to be filled in per row.
+
+    Templates may also be written in markup, see compile_markup::
+
+        >>> render_markup('[bold red]ERROR[/] [dim]{msg}[/]', msg='Disk full.')
+'''
+import logging
+import re
+import sys
+from collections import OrderedDict
+from string import Formatter
+
+from .constants import ALL_PALETTES
+from .core import _SGR_DEFAULT, _parse_sgr, _sgr_transition
+from .disabled import _EmptyBin
+from .style import (BackgroundPalette, EffectsPalette, EffectsTerminator,
+                    ForegroundPalette)
+
+
+log = logging.getLogger(__name__)
+
+_field_splitter = re.compile(r'([^.[]*)(.*)', re.S)  # name, attrs/indexes
+_parse = Formatter().parse
+
+
+def _current_palettes():
+    ''' Return the palettes of the console package at this time. '''
+    package = sys.modules[__package__]
+    return dict(fg=package.fg, bg=package.bg, fx=package.fx,
+                defx=package.defx)
+
+
+def _resolve_style(field_name, palettes):
+    ''' Render a style reference, e.g. "fg.red+fx.bold", to a string. '''
+    result = []
+    for reference in field_name.split('+'):
+        palette_name, _, attr_name = reference.strip().partition('.')
+        result.append(str(getattr(palettes[palette_name], attr_name)))
+    return ''.join(result)
+
+
+def _make_converter(attrs, conversion, format_spec):
+    ''' Return a function to format a data field value. '''
+    if attrs or conversion:  # let format handle the rest
+        conversion = '!' + conversion if conversion else ''
+        format_spec = ':' + format_spec if format_spec else ''
+        return f'{{0{attrs}{conversion}{format_spec}}}'.format
+    elif format_spec:
+        return lambda value: format(value, format_spec)
+    else:
+        return str
+
+
+class StyleTemplate:
+    ''' A format string with styles, parsed and resolved once.
+
+        Arguments:
+            format_string   Text with replacement fields, as str.format.
+                            Fields starting with a palette name, e.g.
+                            {fg.red} or {fx.bold+bg.blue}, are styles.
+                            Format specs are fixed when compiled, nested
+                            fields in them, e.g. {0:{1}}, are not
+                            supported and raise ValueError.
+            palettes        Optional mapping of palette names to palettes,
+                            defaults to fg, bg, fx, defx of the console
+                            package.
+    '''
+    def __init__(self, format_string, palettes=None):
+        if palettes is None:
+            palettes = _current_palettes()
+        self.format_string = format_string
+        parts = ['']    # literals, with a slot for each data field
+        fields = []     # (slot, key, converter)
+        auto_number = 0
+
+        for literal, field_name, format_spec, conversion in \
+                _parse(format_string):
+            parts[-1] += literal
+            if field_name is None:
+                continue
+            if '{' in format_spec:
+                raise ValueError(f'nested field in format spec of '
+                                 f'{{{field_name}:{format_spec}}} is not '
+                                 'supported, format the value beforehand.')
+            name, attrs = _field_splitter.match(field_name).groups()
+            if name in palettes:
+                parts[-1] += _resolve_style(field_name, palettes)
+                continue
+
+            if name == '':
+                key = auto_number
+                auto_number += 1
+            elif name.isdigit():
+                key = int(name)
+            else:
+                key = name
+            fields.append((len(parts), key,
+                           _make_converter(attrs, conversion, format_spec)))
+            parts.extend((None, ''))
+
+        self._parts = parts
+        self._fields = tuple(fields)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.format_string!r})'
+
+    def render(self, *args, **kwargs):
+        ''' Render one row from positional and/or keyword arguments. '''
+        if kwargs:
+            row = kwargs
+            row.update(enumerate(args))
+        else:
+            row = args
+        line = self._parts[:]
+        for slot, key, convert in self._fields:
+            line[slot] = convert(row[key])
+        return ''.join(line)
+
+    def render_many(self, rows, end='\n'):
+        ''' Render many rows to a single string.
+
+            Arguments:
+                rows    An iterable of sequences for numbered or automatic
+                        fields, or mappings for named fields.
+                end     Appended to each row.
+        '''
+        parts = self._parts
+        fields = self._fields
+        result = []
+        extend = result.extend
+        for row in rows:
+            line = parts[:]
+            for slot, key, convert in fields:
+                line[slot] = convert(row[key])
+            line.append(end)
+            extend(line)
+        return ''.join(result)
+
+
+# -- markup ------------------------------------------------------------------
+MAX_MARKUP = 256            # compiled markup kept, least recently used out
+_markup_cache = OrderedDict()   # (source, palette, …): template
+_tag_finder = re.compile(r'\[\[|\[(/?)([\w .+#-]*)\]', re.A)
+_palette_classes = dict(fg=ForegroundPalette, bg=BackgroundPalette,
+                        fx=EffectsPalette, defx=EffectsTerminator)
+_name_checkers = {}         # palette name: enabled palette, see _get_entry
+
+
+def _get_entry(palettes, palette_name, attr_name):
+    ''' Look up a palette entry, raising AttributeError if not a style.
+
+        A disabled palette returns an empty entry for any name, so names
+        are checked against an enabled palette of the same kind instead.
+    '''
+    palette = palettes[palette_name]
+    if isinstance(palette, _EmptyBin):
+        checker = _name_checkers.get(palette_name)
+        if checker is None:
+            cls = _palette_classes.get(palette_name)
+            if cls is None:
+                raise AttributeError(f'{palette_name!r} is disabled.')
+            checker = _name_checkers[palette_name] = cls(palettes=ALL_PALETTES)
+        getattr(checker, attr_name)
+    return getattr(palette, attr_name)
+
+
+def _resolve_tag(content, palettes):
+    ''' Find the entries named in a tag, e.g.: "bold red on white",
+        "not bold", or "fg.i123".  Returns None if a name isn't a style.
+    '''
+    entries = []
+    palette_name = None     # set by "on" and "not", for the next word
+    try:
+        for word in content.split():
+            if word in ('on', 'not'):
+                palette_name = 'bg' if word == 'on' else 'defx'
+                continue
+            if '.' in word:
+                name, _, attr_name = word.partition('.')
+                entry = _get_entry(palettes, name, attr_name)
+            elif palette_name:
+                entry = _get_entry(palettes, palette_name, word)
+            else:  # effects first, then foreground
+                try:
+                    entry = _get_entry(palettes, 'fx', word)
+                except AttributeError:
+                    entry = _get_entry(palettes, 'fg', word)
+            entries.append(entry)
+            palette_name = None
+    except (AttributeError, KeyError):
+        return None
+    return entries if entries and not palette_name else None
+
+
+def _render_markup(source, palettes):
+    ''' Render tags to the shortest escape sequences between them. '''
+    result = []
+    stack = []              # states of the open tags
+    state = _SGR_DEFAULT
+    pos = 0
+    for match in _tag_finder.finditer(source):
+        result.append(source[pos:match.start()])
+        pos = match.end()
+        closing, content = match.groups()
+        if content is None:  # [[
+            result.append('[')
+            continue
+
+        if closing:
+            if not stack:
+                result.append(match.group())
+                continue
+            new_state = stack.pop()
+        else:
+            entries = _resolve_tag(content, palettes)
+            if entries is None:  # not markup, e.g.: "[INFO]"
+                result.append(match.group())
+                continue
+            new_state = state
+            for entry in entries:
+                if entry:  # disabled palettes render nothing
+                    new_state = _parse_sgr(entry._codes, new_state)
+            stack.append(state)
+
+        result.append(_sgr_transition(state, new_state))
+        state = new_state
+
+    result.append(source[pos:])
+    result.append(_sgr_transition(state, _SGR_DEFAULT))
+    return ''.join(result)
+
+
+def compile_markup(source, palettes=None):
+    ''' Compile markup to a StyleTemplate, e.g.::
+
+            compile_markup('[bold red]ERROR[/] [dim]{msg}[/]')
+
+        Tags name styles from fx, fg, bg ("on white"), and defx ("not bold")
+        or any palette explicitly ("fg.i123"), and are closed by "[/]" in
+        order.  Brackets not naming styles are left as is, and "[[" gives
+        a single bracket.  The remaining text is a format string, see
+        StyleTemplate.
+
+        Compiled markup is cached by source, up to MAX_MARKUP of them.
+    '''
+    if palettes is None:
+        palettes = _current_palettes()
+    key = (source,) + tuple(palettes.values())
+    template = _markup_cache.get(key)
+    if template is None:
+        template = StyleTemplate(_render_markup(source, palettes), palettes)
+        _markup_cache[key] = template
+        if len(_markup_cache) > MAX_MARKUP:
+            _markup_cache.popitem(last=False)
+    else:
+        try:
+            _markup_cache.move_to_end(key)
+        except KeyError:  # evicted by another thread meanwhile
+            pass
+    return template
+
+
+def render_markup(source, *args, **kwargs):
+    ''' Compile markup (once) and render it with the given field values. '''
+    return compile_markup(source).render(*args, **kwargs)
@@ -594,7 +594,8 @@ if True:  # fold
         assert result == outf.getvalue()
 
     def test_find_nearest_color_index():
-        from .proximity import find_nearest_color_index
+        from .proximity import (color_table8, find_nearest_color_index,
+                                _find_nearest_in)
         values = (
             (0, 0, 0, 0),       # r, g, b, index
             (16, 16, 16, 233),
@@ -602,9 +603,14 @@ if True:  # fold
             (0, 256, 0, 10),
             (176, 0, 176, 127),
             (256, 256, 256, 15),
+            (115, 115, 115, 243),  # cube & grey ties
+            (47, 48, 155, 24),
         )
+        full = range(len(color_table8))
         for val in values:
             assert find_nearest_color_index(*val[:3]) == val[3]
+            # same as a full scan
+            assert _find_nearest_in(*val[:3], color_table8, full) == val[3]
 
     def test_find_nearest_color_hexstr():
         from .proximity import find_nearest_color_hexstr
@@ -643,3 +649,699 @@ if True:  # fold
 
         assert attrid1 == attrid2
         assert attrid3 == attrid4
+
+    def test_find_nearest_lookup_table():
+        ''' Lookup table results must match a full scan. '''
+        from .proximity import (color_table4, color_table8, _find_nearest_in,
+                                find_nearest_color_index)
+        for table in (color_table8, color_table4):
+            full = range(len(table))
+            for r in range(0, 256, 15):
+                for g in range(0, 256, 15):
+                    for b in range(0, 256, 15):
+                        assert (find_nearest_color_index(r, g, b, table) ==
+                                _find_nearest_in(r, g, b, table, full))
+
+    def test_lookup_table_cache(tmpdir):
+        from .proximity import color_table8, build_lookup_table
+        table = build_lookup_table(color_table8, cache_dir=str(tmpdir))
+        assert len(tmpdir.listdir()) == 1
+        assert build_lookup_table(color_table8, cache_dir=str(tmpdir)) == table
+
+    def test_find_nearest_color_indexes():
+        from .proximity import (color_table4, color_table8,
+                                find_nearest_color_index,
+                                find_nearest_color_indexes)
+        colors = ((0, 0, 0), (16, 16, 16), (255, 0, 0), (176, 0, 176),
+                  (233, 84, 32), (255, 255, 255), (128, 128, 128))
+        data = bytes(value for color in colors for value in color)
+        for table in (color_table8, color_table4):
+            results = find_nearest_color_indexes(data, color_table=table)
+            assert list(results) == [find_nearest_color_index(*color, table)
+                                     for color in colors]
+            results = find_nearest_color_indexes(colors, color_table=table)
+            assert len(results) == len(colors)
+
+    def test_find_nearest_color_indexes_pure(monkeypatch):
+        from array import array
+        from . import proximity
+        from .proximity import (color_table4, color_table8,
+                                find_nearest_color_index,
+                                find_nearest_color_indexes)
+        colors = ((0, 0, 0), (16, 16, 16), (255, 0, 0), (176, 0, 176),
+                  (233, 84, 32), (255, 255, 255), (16, 16, 16))
+        data = bytes(value for color in colors for value in color)
+        inputs = [data, bytearray(data), memoryview(data), colors]
+        if proximity.numpy:
+            inputs.append(proximity.numpy.array(colors,
+                                                dtype=proximity.numpy.uint8))
+        monkeypatch.setattr(proximity, 'numpy', None)
+        for table in (color_table8, color_table4):
+            expected = [find_nearest_color_index(*color, table)
+                        for color in colors]
+            for colors_in in inputs:
+                results = find_nearest_color_indexes(colors_in,
+                                                     color_table=table)
+                assert isinstance(results, array)
+                assert list(results) == expected
+        with pytest.raises(ValueError, match='multiple of three'):
+            find_nearest_color_indexes(data[:-1])
+
+    def test_find_nearest_methods():
+        from .proximity import (color_table4, find_nearest_color_index,
+                                _delta_e2000, METHODS)
+        # Sharma et al. reference pair
+        assert round(_delta_e2000((50, 2.6772, -79.7751),
+                                  (50, 0, -82.7485)), 4) == 2.0425
+
+        for method in METHODS:
+            assert find_nearest_color_index(0, 0, 0, method=method) == 0
+            assert find_nearest_color_index(255, 255, 255, color_table4,
+                                            method=method) == 15
+        assert find_nearest_color_index(233, 84, 32, method='cie76') == 166
+
+        with pytest.raises(ValueError):
+            find_nearest_color_index(0, 0, 0, method='manhattan')
+
+    def test_downgrade_method():
+        bgb = style.BackgroundPalette(palettes='basic',
+                                      downgrade_method='cie76')
+        assert str(bgb.t_e95420) == CSI + '41m'  # not 101 as with euclid
+
+        with pytest.raises(ValueError):
+            style.BackgroundPalette(palettes='basic', downgrade_method='foo')
+
+    def test_color_table_tree():
+        from .proximity import ColorTable, _find_nearest_in
+        import random
+        rand = random.Random(4)
+        colors = [(rand.randrange(256), rand.randrange(256), rand.randrange(256))
+                  for i in range(300)]
+        colors.extend(colors[:10])  # duplicates, lowest index should win
+        table = ColorTable(colors)
+        full = range(len(colors))
+        for i in range(500):
+            r, g, b = rand.randrange(256), rand.randrange(256), rand.randrange(256)
+            assert (table.find_nearest_index(r, g, b) ==
+                    _find_nearest_in(r, g, b, colors, full))
+
+    def test_color_table_downgrade():
+        from .proximity import ColorTable
+        greys = ColorTable((v, v, v) for v in range(0, 256, 16))
+        bge = style.BackgroundPalette(palettes=('basic', 'extended'),
+                                      extended_color_table=greys)
+        assert str(bge.t_808080) == CSI + '48;5;8m'
+        bgb = style.BackgroundPalette(palettes='basic',
+                                      basic_color_table=greys)
+        assert str(bgb.t_ff0000) == CSI + '45m'  # nearest: 5, 0x50 grey
+
+        grey256 = ColorTable((v, v, v) for v in range(256))  # at the limits
+        assert style.BackgroundPalette(palettes='basic',
+                                       basic_color_table=greys[:16])
+        bge = style.BackgroundPalette(palettes=('basic', 'extended'),
+                                      extended_color_table=grey256)
+        assert str(bge.t_ffffff) == CSI + '48;5;255m'
+        with pytest.raises(ValueError, match='larger'):
+            style.BackgroundPalette(palettes='basic',
+                                    basic_color_table=greys + greys[:1])
+        with pytest.raises(ValueError, match='larger'):
+            style.ForegroundPalette(palettes=ALL_PALETTES,
+                                    extended_color_table=grey256 + greys[:1])
+
+    def test_entry_cache_bounded():
+        fgc = style.ForegroundPalette(palettes=ALL_PALETTES, cache_size=2)
+        first = fgc.t_111
+        fgc.t_222
+        assert fgc.t_111 is first               # hit, now most recent
+        fgc.t_333                               # evicts t_222
+        assert fgc.cache_info() == (1, 3, 1, 2, 2)
+        assert 't_111' not in vars(fgc)         # not stored as attributes
+
+        fgc.clear()
+        assert fgc.cache_info() == (0, 0, 0, 2, 0)
+        assert str(fgc.red) == CSI + '31m'      # basic entries remain
+
+    def test_entry_cache_bounded_threaded():
+        import random, sys, threading
+        fgc = style.ForegroundPalette(palettes=ALL_PALETTES, cache_size=64)
+        errors = []
+
+        def work():
+            rand = random.Random()
+            try:
+                for _ in range(4000):
+                    r, g = rand.randrange(8), rand.randrange(16)
+                    assert fgc.rgb(r, g, 0) is not None
+                    assert fgc.index(rand.randrange(256)) is not None
+            except Exception as err:
+                errors.append(err)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)    # switch often, to provoke races
+        try:
+            threads = [threading.Thread(target=work) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        assert not errors
+        assert len(fgc._entries) <= 64
+
+    def test_entry_cache_clear():
+        fgc = style.ForegroundPalette(palettes=ALL_PALETTES)
+        fgc.t_111
+        assert 't_111' in vars(fgc)
+        assert fgc.cache_info().currsize == 1
+
+        fgc.clear()
+        assert 't_111' not in vars(fgc)
+        assert str(fgc.red) == CSI + '31m'
+        assert str(fgc.t_111) == CSI + '38;2;17;17;17m'
+
+    def test_entry_constructors():
+        assert fg.rgb(187, 0, 187) is fg.rgb(187, 0, 187)
+        for cache_size in (None, 4):    # one entry per color, either way
+            fgs = style.ForegroundPalette(palettes=ALL_PALETTES,
+                                          cache_size=cache_size)
+            assert fgs.rgb(187, 0, 187) is fgs.t_bb00bb is fgs.tb0b
+            assert fgs.t_112233 is fgs.hex('112233') is fgs.rgb(17, 34, 51)
+            assert fgs.i_111 is fgs.index(111) is fgs.i111
+            assert len(fgs._entries) == 3
+        assert str(fg.rgb(255, 0, 187)) == str(fg.t_ff00bb)
+        assert str(bg.hex('b0b')) == CSI + '48;2;187;0;187m'
+        assert str(bg.hex('FF00BB')) == str(bg.tff00bb)
+        assert str(fg.index(111)) == str(fg.i_111)
+        assert str(bg.index(0)) == CSI + '48;5;0m'
+
+        bgb = style.BackgroundPalette(palettes='basic')
+        assert str(bgb.rgb(233, 84, 32)) == str(bgb.t_e95420)
+        assert str(bgb.index(160)) == CSI + '41m'
+
+        for args in ((256, 0, 0), (-1, 0, 0)):
+            with pytest.raises(ValueError):
+                fg.rgb(*args)
+        with pytest.raises(ValueError):
+            fg.index(256)
+        with pytest.raises(ValueError):
+            fg.hex('bb00')
+
+    def test_entry_immutable():
+        with pytest.raises(AttributeError):
+            fg.red.default = fx.end
+        with pytest.raises(AttributeError):
+            fg.red.extra = 1
+        # the default entry ends with itself:
+        assert fg.default('x') == f'{CSI}39mx{CSI}39m'
+        assert fg.red.template() == f'{CSI}31m{{}}{CSI}39m'
+
+    def test_entry_addition_interned():
+        from .constants import ANSI_RESET
+        assert (fx.bold + fg.red) is (fx.bold + fg.red)
+        assert (fx.bold + fg.red) is not (fg.red + fx.bold)
+        assert (fg.red + fg.blue).default is fg.default     # same palette
+        assert (fg.red + bg.blue).default == ANSI_RESET     # mixed
+        assert str(fg.red + bg.blue + fx.bold) == CSI + '31;44;1m'
+
+    def test_entry_addition_threaded():
+        import random, sys, threading
+        effects = (fx.bold, fx.dim, fx.italic, fx.underline, fx.reverse)
+        errors = []
+
+        def work():
+            rand = random.Random()
+            try:
+                for _ in range(4000):
+                    left = fg.index(rand.randrange(256))
+                    right = rand.choice(effects +
+                                        (fg.index(rand.randrange(256)),))
+                    assert str(left + right)
+            except Exception as err:
+                errors.append(err)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)    # switch often, to provoke races
+        try:
+            threads = [threading.Thread(target=work) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        assert not errors
+
+    def test_palette_lazy_entries():
+        fgl = style.ForegroundPalette(palettes=ALL_PALETTES)
+        assert 'red' not in vars(fgl)
+        assert str(fgl.red) == CSI + '31m'
+        assert 'red' in vars(fgl)
+        assert fgl.red is fgl.red
+        assert style.ForegroundPalette.red == 31        # class keeps codes
+        assert style.EffectsTerminator.fg == 39
+
+        fgn = style.ForegroundPalette(palettes=('extended',))  # no basic
+        assert str(fgn.red) == ''
+
+        scr = screen.Screen(force=True)
+        assert scr.up is scr.up
+        assert screen.Screen.up == 'A'
+
+    def test_palette_unknown_names():
+        fgu = style.ForegroundPalette(palettes=ALL_PALETTES)
+        for _ in range(2):  # second time from the negative cache
+            with pytest.raises(AttributeError, match='recognized'):
+                fgu.tbob
+        assert 'tbob' in fgu._unknown
+        assert not hasattr(fgu, 'i_9999')
+        assert not hasattr(fgu, '')
+        assert str(fgu.i_123) == CSI + '38;5;123m'
+        assert str(fgu.n_f0f) == CSI + '38;5;13m'
+        fgu.clear()
+        assert not fgu._unknown
+
+    def test_entry_stream():
+        import io
+        from .disabled import empty
+        text = 'one\n\ntwo\nthree'
+        assert ''.join(fg.red.stream(text)) == fg.red(text)
+        # lines spanning chunks, line endings kept
+        chunks = ['o', 'ne\n', '\ntw', 'o\nthree\n']
+        assert ''.join(fg.red.stream(chunks)) == fg.red(text) + '\n'
+        assert ''.join(fg.red.stream(io.StringIO(text), fx.bold)) == \
+            fg.red(text, fx.bold)
+        out = io.StringIO()
+        assert fg.red.stream(iter(chunks), file=out) == len(out.getvalue())
+        assert out.getvalue() == fg.red(text) + '\n'
+        assert ''.join(fg.red.stream('')) == ''
+        assert ''.join(empty.stream(chunks)) == text + '\n'
+
+    def test_line_writer_buffered():
+        from .core import _LineWriter
+        stream = StringIO()
+        outf = _LineWriter(fg.red, stream, fg.default, max_lines=3)
+        print('one\ntwo', file=outf)
+        assert stream.getvalue() == ''                  # buffered
+        print('three', end='', file=outf)
+        outf.write('\n\n')
+        assert stream.getvalue() == (f'{CSI}31mone{CSI}39m\n'
+                                     f'{CSI}31mtwo{CSI}39m\n'
+                                     f'{CSI}31mthree{CSI}39m'
+                                     f'{CSI}31m{CSI}39m\n'
+                                     f'{CSI}31m{CSI}39m\n')
+        outf.write('four')
+        assert outf.getvalue().endswith(f'{CSI}31mfour{CSI}39m')  # flushed
+
+        class TTY(StringIO):
+            def isatty(self):
+                return True
+
+        assert _LineWriter(fg.red, TTY(), fg.default).max_lines == 1
+
+    def test_context_mgr_stack(monkeypatch):
+        import sys, threading, asyncio
+        out = StringIO()
+        monkeypatch.setattr(sys, 'stdout', out)
+        fgs = style.ForegroundPalette(palettes=ALL_PALETTES)
+        fxs = style.EffectsPalette(palettes=ALL_PALETTES)
+        red, blue, bold = fgs.red, fgs.blue, fxs.bold
+        for entry in (red, blue, bold):
+            entry.set_output(out)
+
+        with red:       # nested blocks keep outer styles
+            print('a')
+            with bold:
+                with blue:  # red is overridden
+                    print('b')
+            print('c')
+        print('d')
+        assert sys.stdout is out
+        assert out.getvalue() == (f'{CSI}31ma{CSI}39m\n'
+                                  f'{CSI}1m{CSI}34mb{CSI}0m{CSI}39m\n'
+                                  f'{CSI}31mc{CSI}39m\n'
+                                  f'{CSI}39md\n')
+
+        def worker(entry, text, barrier):  # threads don't share styles
+            barrier.wait()
+            with entry:
+                for _ in range(100):
+                    print(text)
+                    barrier.wait()
+
+        out.seek(0); out.truncate()
+        barrier = threading.Barrier(2)
+        threads = [threading.Thread(target=worker, args=(entry, text, barrier))
+                   for entry, text in ((red, 'r'), (blue, 'b'))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        lines = out.getvalue().replace(f'{CSI}39m', '').split('\n')
+        assert set(lines) == {f'{CSI}31mr', f'{CSI}34mb', ''}
+        assert lines.count(f'{CSI}31mr') == lines.count(f'{CSI}34mb') == 100
+
+        async def task(entry, text):  # nor do tasks
+            with entry:
+                await asyncio.sleep(0)
+                print(text)
+
+        async def main():
+            await asyncio.gather(task(red, 'r'), task(blue, 'b'))
+            print('plain')
+
+        out.seek(0); out.truncate()
+        asyncio.run(main())
+        assert out.getvalue() == (f'{CSI}31mr{CSI}39m\n{CSI}39m'
+                                  f'{CSI}34mb{CSI}39m\n{CSI}39m'
+                                  'plain\n')
+        assert sys.stdout is out
+
+    def test_sgr_renderer():
+        from .core import SGRRenderer, render_segments
+        from .disabled import empty
+        segments = [(fg.red, 'a'), (fg.red + fx.bold, 'b'),
+                    (fg.red + fx.dim, 'c'), (bg.blue, 'd'), (None, ' '),
+                    (fg.i123 + fx.italic, 'e'), (fx.italic, 'f')]
+        renderer = SGRRenderer()
+        assert renderer.render(segments) == (
+            f'{CSI}31ma{CSI}1mb{CSI}22;2mc{CSI}0;44md{CSI}0m '
+            f'{CSI}3;38;5;123me{CSI}39mf{CSI}0m')
+        naive = ''.join(style(text) if style else text
+                        for style, text in segments)
+        info = renderer.info()
+        assert info.naive == len(naive)
+        assert info.saved == len(naive) - info.emitted == 18
+
+        renderer = SGRRenderer()   # state kept between renders
+        assert renderer.render([(fg.red, 'a')], finish=False) == f'{CSI}31ma'
+        assert renderer.render([(fg.red, 'b'), 'c', (empty, 'd')]) == \
+            f'b{CSI}0mcd'
+        assert render_segments(['plain']) == 'plain'
+
+    def test_style_template():
+        from .template import StyleTemplate
+        palettes = dict(fg=fg, bg=bg, fx=fx, defx=defx)
+        tmpl = StyleTemplate('{fx.dim}{time}{fx.end} {fg.red+fx.bold}'
+                             '{level:<5}{fx.end} {msg!r} {{}}', palettes)
+        expected = (f'{CSI}2m12:00{CSI}0m {CSI}31m{CSI}1mWARN {CSI}0m '
+                    "'Disk' {}")
+        row = dict(time='12:00', level='WARN', msg='Disk')
+        assert tmpl.render(**row) == expected
+        assert tmpl.render_many([row, row]) == f'{expected}\n{expected}\n'
+
+        tmpl = StyleTemplate('{fg.blue}{}{fg.default}: {0.real} {1[0]}',
+                             palettes)
+        assert tmpl.render_many([(2, 'xy')], end='') == \
+            f'{CSI}34m2{CSI}39m: 2 x'
+        assert StyleTemplate('plain')._parts == ['plain']
+        with pytest.raises(ValueError, match='nested'):
+            StyleTemplate('{0:{1}}', palettes)
+
+    def test_markup():
+        from . import template
+        palettes = dict(fg=fg, bg=bg, fx=fx, defx=defx)
+        compile_markup = template.compile_markup
+        tmpl = compile_markup('[bold red]ERROR[/] [dim]{msg}[/]', palettes)
+        assert tmpl.render(msg='Disk') == \
+            f'{CSI}1;31mERROR{CSI}0m {CSI}2mDisk{CSI}0m'
+        assert compile_markup('[bold red]ERROR[/] [dim]{msg}[/]',
+                              palettes) is tmpl     # cached
+        assert compile_markup('[INFO] [[x] [red on white]a [not bold]b[/]'
+                              ' c[/] [/]', palettes).render() == \
+            f'[INFO] [x] {CSI}31;47ma b c{CSI}0m [/]'
+        assert compile_markup('[red]x [blue]y[/] z', palettes).render() == \
+            f'{CSI}31mx {CSI}34my{CSI}31m z{CSI}0m'
+
+        template._markup_cache.clear()
+        for i in range(template.MAX_MARKUP + 1):
+            compile_markup(f'[red]{i}[/]', palettes)
+        assert len(template._markup_cache) == template.MAX_MARKUP
+        assert ('[red]0[/]',) + tuple(palettes.values()) not in \
+            template._markup_cache
+
+        from .disabled import empty_bin     # names checked, text kept
+        disabled = dict(fg=empty_bin, bg=empty_bin, fx=empty_bin,
+                        defx=empty_bin)
+        assert compile_markup('[INFO] [bold]x[/] [on red]y[/] [fg.t_bb00bb]z'
+                              '[/] [nope] started', disabled).render() == \
+            '[INFO] x y z [nope] started'
+
+    def test_markup_threaded(monkeypatch):
+        import random, sys, threading
+        from . import template
+        monkeypatch.setattr(template, 'MAX_MARKUP', 16)   # evict often
+        template._markup_cache.clear()
+        palettes = dict(fg=fg, bg=bg, fx=fx, defx=defx)
+        sources = ['[red]%s[/]' % i for i in range(24)]
+        errors = []
+
+        def work():
+            rand = random.Random()
+            try:
+                for _ in range(20000):
+                    template.compile_markup(rand.choice(sources), palettes)
+            except Exception as err:
+                errors.append(err)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)    # switch often, to provoke races
+        try:
+            threads = [threading.Thread(target=work) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        assert not errors
+        assert len(template._markup_cache) <= 16
+        tmpl = template.compile_markup('[red]7[/]', palettes)
+        assert tmpl.render() == f'{CSI}31m7{CSI}0m'
+
+    def test_strip_ansi_single_pass():
+        for c1 in (False, True):
+            for osc in (False, True):
+                expected = utils.strip_ansi(txt, c1=c1, osc=osc)
+                data = txt.encode('latin1')
+                for value in (data, bytearray(data), memoryview(data)):
+                    assert utils.strip_ansi(value, c1=c1, osc=osc) == \
+                        expected.encode('latin1')
+
+        text = 'a\x1b7b\x1b(Bc\x1bP1$r\x1b\\d\x1b]0;t\x07e\x1b'
+        assert utils.strip_ansi(text, esc=True) == 'abcd\x1b]0;t\x07e'
+        assert utils.strip_ansi(text, esc=True, osc=True) == 'abcde'
+        assert utils.strip_ansi(text.encode(), esc=True, osc=True) == b'abcde'
+
+    def test_display_width():
+        width = utils.display_width
+        assert width('Hang Loose') == 10
+        assert width('Hang \x1b[34;4;5mLoose\x1b[0m, Hawaii') == 18
+        assert width('日本語') == 6
+        assert width('é') == 1                     # combining
+        assert width('\U0001f44d') == 2                  # emoji
+        assert width('\U0001f468‍\U0001f469') == 2  # joined
+        assert width('❤️') == 2                # presentation
+        assert width('\U0001f44d\U0001f3fd') == 2            # skin tone
+        assert width('a\U0001f3fd') == 3                 # swatch, alone
+        assert width('\U0001f1fa\U0001f1f8') == 2            # flag
+        assert width('\U0001f1fa\U0001f1f8\U0001f1e6') == 3    # and a half
+        assert width('\U0001f1fa\x1b[0mx\x1b[0m\U0001f1f8') == 3
+        assert width('\x1b]0;title\x07a\tb\x1b') == 2
+        assert width('ｱ') == 1                           # halfwidth
+        assert width.cache_info().currsize
+        assert utils.len_stripped('Hang \x1b[34mLoose\x1b[0m') == 10
+
+    def test_ansi_stripper_chunks():
+        text = (txt + '\na\x1b7b\x1bP1$r\x1b\\c\x1b]0;t\x07d\x1b[1;31mX\x1b\n') * 2
+        for options in ((False, False, False), (True, True, True)):
+            for data in (text, text.encode('latin1')):
+                expected = utils.strip_ansi(data, *options)
+                for size in (1, 2, 3, 7, 64):
+                    stripper = utils.AnsiStripper(*options)
+                    result = [stripper.feed(data[i:i + size])
+                              for i in range(0, len(data), size)]
+                    result.append(stripper.flush())
+                    assert data[:0].join(result) == expected
+
+        stripper = utils.AnsiStripper()
+        chunk = b'no escapes here'
+        assert stripper.feed(chunk) is chunk
+        assert stripper.feed(b'x\x1b[3') == b'x'
+        assert stripper.feed(memoryview(b'1mz')) == b'z'
+        assert stripper.feed(b'\x1b') == b''
+        assert stripper.flush() == b'\x1b'
+
+    def test_parser():
+        from .parser import (Parser, parse, CSI, Control, DCS, Escape, OSC,
+                             String, Text)
+        text = ('a\x1b[1;31mb\x1b[?25h\x1b[38:2::1:2:3m\x1b7\x1b(B'
+                '\x1b]0;title\x07\x1b]8;;x\x1b\\\x1bP1$rq\x1b\\\x1b_apc\x9c'
+                '\x1b[1\n2m\x9b0m\x1b[1;2\x18z')
+        expected = [
+            Text('a'), CSI('', (1, 31), '', 'm'), Text('b'),
+            CSI('?', (25,), '', 'h'),
+            CSI('', ((38, 2, None, 1, 2, 3),), '', 'm'),
+            Escape('', '7'), Escape('(', 'B'), OSC('0;title'), OSC('8;;x'),
+            DCS('', (1,), '$', 'r', 'q'), String('APC', 'apc'),
+            Control('\n'), CSI('', (12,), '', 'm'), CSI('', (0,), '', 'm'),
+            Control('\x18'), Text('z'),
+        ]
+        assert list(parse(text)) == expected
+        assert expected[1].is_sgr and not expected[3].is_sgr
+
+        parser = Parser()  # a char at a time, the same
+        tokens = [token for char in text for token in parser.feed(char)]
+        assert tokens == expected
+        assert parser.feed('\x1b[3') == [] and parser.state == 'csi_param'
+        assert parser.flush() == [] and parser.state == 'ground'
+
+    def test_batch(monkeypatch):
+        import sys
+        from . import batch
+
+        class Counted(StringIO):
+            writes = 0
+
+            def write(self, data):
+                self.writes += 1
+                return super().write(data)
+
+        out = Counted()
+        monkeypatch.setattr(sys, 'stdout', out)
+        scr = screen.Screen(force=True, stream=out)
+        with batch() as writer:
+            assert sys.stdout is writer
+            utils.clear_line()
+            with batch():       # joins the outer one
+                print('hello', flush=True)
+            with scr.hidden_cursor():
+                utils.clear_screen()
+            assert out.getvalue() == '' and out.writes == 0
+
+        assert sys.stdout is out and scr._stream is out
+        assert out.getvalue() == (f'{CSI}2Khello\n{CSI}?25l{CSI}2J'
+                                  f'{CSI}?25h')
+        assert out.writes == 1
+
+        other = Counted()   # not stdout
+        with batch(other) as writer:
+            writer.write('a')
+            writer.frame()  # early
+            writer.write('b')
+            assert sys.stdout is out and other.getvalue() == 'a'
+        assert other.getvalue() == 'ab' and other.writes == 2
+
+    def test_screen_frame(monkeypatch):
+        import sys
+        from .screen import MAX_CACHED_SEQUENCES
+
+        class Counted(StringIO):
+            writes = 0
+
+            def write(self, data):
+                self.writes += 1
+                return super().write(data)
+
+        out = Counted()
+        monkeypatch.setattr(sys, 'stdout', out)
+        scr = screen.Screen(force=True, stream=out)
+        with scr.frame() as frame:
+            frame.move(3, 2)
+            frame.erase_line()
+            frame.write('a')
+            with scr.location(1, 5):
+                print('b', end='')
+            frame.erase(0)
+            assert out.writes == 0
+        assert out.getvalue() == (f'{CSI}2;3H{CSI}2Ka\x1b7{CSI}5;1Hb\x1b8'
+                                  f'{CSI}0J')
+        assert out.writes == 1 and sys.stdout is out
+
+        mv = scr.mv     # moves are rendered once, then cached
+        assert mv(7, 9) is mv(7, 9) == f'{CSI}7;9H'
+        for y in range(MAX_CACHED_SEQUENCES + 10):
+            mv(y, 1)
+        assert len(mv._rendered) == MAX_CACHED_SEQUENCES
+
+    def test_screen_caches_threaded():
+        import random, sys, threading
+        scr = screen.Screen(force=True)
+        planner = screen.CursorPlanner(scr)
+        errors = []
+
+        def work():
+            rand = random.Random()
+            try:
+                for _ in range(4000):
+                    x, y = rand.randrange(200), rand.randrange(200)
+                    assert scr.mv(y, x) == f'{CSI}{y};{x}H'
+                    planner.position = (rand.randrange(200), y)
+                    planner.move(x, y)
+            except Exception as err:
+                errors.append(err)
+
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)    # switch often, to provoke races
+        try:
+            threads = [threading.Thread(target=work) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+        assert not errors
+
+    def test_virtual_screen():
+        out = StringIO()
+        scr = screen.Screen(force=True, stream=out)
+        fxs = style.EffectsPalette(palettes=ALL_PALETTES)
+        view = screen.VirtualScreen(10, 4, scr)
+        view.put(0, 0, 'cpu 42%', fxs.bold)
+        view.put(0, 1, 'mem')
+        view.put(8, 3, 'clipped')
+        assert view.present() == (f'{CSI}2J{CSI}H{CSI}1mcpu 42%'
+                                  f'{CSI}E{CSI}0mmem{CSI}4;9Hcl')
+        assert out.getvalue() == f'{CSI}2J{CSI}H{CSI}1mcpu 42%{CSI}E' \
+                                 f'{CSI}0mmem{CSI}4;9Hcl'
+        assert view.present() == ''
+
+        view.put(4, 0, '43', fxs.bold)      # changed cells only
+        view.put(0, 1, 'm')
+        view.put(9, 1, 'x')
+        assert view.present() == f'{CSI}1;6H{CSI}1m3{CSI}2;10H{CSI}0mx'
+        view.put(0, 1, '          ')        # blanks erased
+        assert view.present() == f'{CSI}2H{CSI}0K'
+
+        view.clear()
+        for y in range(4):
+            view.put(0, y, f'line {y}')
+        view.present()
+        view.clear()
+        for y in range(4):                  # moved up a line, scrolled
+            view.put(0, y, f'line {y + 1}')
+        assert view.present() == f'{CSI}1S\rline 4'
+
+        view.redraw()
+        assert view.present().startswith(f'{CSI}2J{CSI}Hline 1{CSI}E')
+
+    def test_cursor_planner():
+        planner = screen.CursorPlanner(sc)
+        assert planner.move(4, 2) == f'{CSI}3;5H'   # unknown, absolute
+        assert planner.move(4, 2) == ''
+        planner.advance(3)
+        assert planner.move(0, 2) == '\r'
+        assert planner.move(0, 3) == f'{CSI}B'
+        assert planner.move(0, 9) == f'{CSI}6B'
+        assert planner.move(2, 9) == f'{CSI}2C'
+        assert planner.move(0, 11) == f'{CSI}2E'    # down to the first column
+        planner.advance(5)
+        assert planner.move(0, 9) == f'{CSI}2F'     # up to the first column
+        assert planner.move(2, 9) == f'{CSI}2C'
+        assert planner.move(30, 9) == f'{CSI}28C'
+        assert planner.move(100, 150) == f'{CSI}151;101H'
+        assert planner.move(100, 2) == f'{CSI}3d'   # row
+        assert planner.move(3, 2) == f'{CSI}4G'     # column
+        assert planner.move(0, 0) == f'{CSI}H'
+        assert planner.info() == (91, 56, 35)
@@ -13,6 +13,9 @@
 import os
 import logging
 import re
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
 
 from .constants import OSC, BEL
 from .screen import screen
@@ -119,39 +122,255 @@ def set_title(title, mode=0):
             return text  # for testing
 
 
-def strip_ansi(text, c1=False, osc=False):
+# Single pass: one pattern of alternatives per combination of options,
+# compiled on first use, for str and bytes alike:
+_strippers = {}     # (is_str, c1, osc, esc): pattern
+
+
+def _get_stripper(is_str, c1, osc, esc):
+    ''' Combine the sequences to strip into one pattern. '''
+    esc_parts = [r'\[[0-?]*[ -/]*[@-~]']          # CSI
+    if osc:  # OSC, to BEL or ST on the same line, loop unrolled for speed:
+        esc_parts.append(r'\][^\x07\x1b\n]*(?:\x1b(?!\\)[^\x07\x1b\n]*)*'
+                         r'(?:\x07|\x1b\\)')
+    if esc:
+        esc_parts.append(r'[PX^_].*?\x1b\\')       # DCS, SOS, PM, APC
+        # the rest: two char, nF, or lone escapes, leave OSC if not asked
+        esc_parts.append(r'(?:[ -/]*[0-~])?' if osc else
+                         r'(?!\])(?:[ -/]*[0-~])?')
+    parts = [r'\x1b(?:%s)' % '|'.join(esc_parts)]
+    if c1:
+        parts.append(r'\x9b[0-?]*[ -/]*[@-~]')      # C1 CSI
+        if osc:
+            parts.append(r'\x9d[^\x07\x9c\n]*(?:\x07|\x9c)')  # C1 OSC
+    pattern = '|'.join(parts)
+    if not is_str:
+        pattern = pattern.encode('latin1')
+    stripper = _strippers[(is_str, c1, osc, esc)] = re.compile(pattern)
+    return stripper
+
+
+def strip_ansi(text, c1=False, osc=False, esc=False):
     ''' Strip ANSI escape sequences from a portion of text.
         https://stackoverflow.com/a/38662876/450917
 
         Arguments:
-            line: str
+            text: str, bytes, bytearray, or memoryview
             osc: bool  - include OSC commands in the strippage.
             c1:  bool  - include C1 commands in the strippage.
+            esc: bool  - include other escape sequences, e.g. "ESC 7",
+                         "ESC ( B", DCS strings, and lone escapes.
 
         Notes:
-            Enabling c1 and osc stripping is less efficient and the two options
-            can mildly conflict with one another.
-            The less problematic order was chosen, so there may still be rare
-            C1 OSC fragments left over.
+            The text is scanned once, for all sequences asked for.
+            Bytes are returned for bytes-like input, without decoding;
+            C1 stripping of UTF-8 bytes is best avoided however,
+            as its codes are UTF-8 continuation bytes.
     '''
-    text = ansi_csi0_finder.sub('', text)
-    if osc:
-        text = ansi_osc0_finder.sub('', text)
-    if c1:
-        text = ansi_csi1_finder.sub('', text)  # go first, less destructive
-        if osc:
-            text = ansi_osc1_finder.sub('', text)
-    return text
+    is_str = isinstance(text, str)
+    if c1 and isinstance(text, (str, bytes, bytearray)):
+        # the simpler pattern is quicker, when there are no C1 codes:
+        codes = ('\x9b', '\x9d') if is_str else (b'\x9b', b'\x9d')
+        c1 = codes[0] in text or (osc and codes[1] in text)
+    stripper = (_strippers.get((is_str, c1, osc, esc)) or
+                _get_stripper(is_str, c1, osc, esc))
+    return stripper.sub('' if is_str else b'', text)
 
 
 def len_stripped(text):
     ''' Return the length of a string minus its ANSI escape sequences.
 
-        Useful to find if a string will fit inside a given length on screen.
+        Useful to find if a string will fit inside a given length on screen,
+        see also display_width.
     '''
     return len(strip_ansi(text))
 
 
+_partial_finders = {}  # (is_str, c1, osc, esc): pattern
+
+
+def _get_partial_finder(is_str, c1, osc, esc):
+    ''' Find a sequence begun but not finished at the end of text, i.e.:
+        one that could still be completed by the text that follows.
+    '''
+    esc_parts = [r'\[[0-?]*[ -/]*']                         # CSI
+    if osc:
+        esc_parts.append(r'\](?:[^\x07\x1b\n]|\x1b(?!\\))*')   # OSC
+    if esc:
+        esc_parts.append(r'[PX^_](?:[^\x1b\n]|\x1b(?!\\))*')     # DCS…
+        esc_parts.append(r'[ -/]+')                           # nF
+    parts = [r'\x1b(?:%s)?' % '|'.join(esc_parts)]
+    if c1:
+        parts.append(r'\x9b[0-?]*[ -/]*')
+        if osc:
+            parts.append(r'\x9d[^\x07\x9c\n]*')
+    pattern = r'(?:%s)\Z' % '|'.join(parts)
+    if not is_str:
+        pattern = pattern.encode('latin1')
+    finder = _partial_finders[(is_str, c1, osc, esc)] = re.compile(pattern)
+    return finder
+
+
+class AnsiStripper:
+    ''' Strips ANSI escape sequences from text arriving in chunks, e.g. read
+        from a pipe, carrying a sequence split between chunks over to the
+        next.  Works on str or bytes, options as strip_ansi::
+
+            stripper = AnsiStripper(osc=True)
+            for chunk in iter(partial(pipe.read, 4096), b''):
+                out.write(stripper.feed(chunk))
+            out.write(stripper.flush())
+
+        Chunks without escape sequences are returned as is.
+    '''
+    def __init__(self, c1=False, osc=False, esc=False):
+        self.c1 = c1
+        self.osc = osc
+        self.esc = esc
+        self._pending = None    # unfinished sequence from the last chunk
+        self._empty = ''        # or b'', as the last chunk
+
+    def feed(self, chunk):
+        ''' Strip a chunk, returning what is complete so far. '''
+        is_str = isinstance(chunk, str)
+        if not is_str and not isinstance(chunk, bytes):
+            chunk = bytes(chunk)    # bytearray, memoryview
+        self._empty = chunk[:0]
+        pending = self._pending
+        if pending:
+            chunk = pending + chunk
+            self._pending = None
+        escape = '\x1b' if is_str else b'\x1b'
+        if escape not in chunk and not (self.c1 and _has_c1(chunk, is_str)):
+            return chunk  # the fast path
+
+        # sequences can't span lines, search for a partial one in the last:
+        options = (is_str, self.c1, self.osc, self.esc)
+        finder = (_partial_finders.get(options) or
+                  _get_partial_finder(*options))
+        partial = finder.search(chunk, chunk.rfind('\n' if is_str else b'\n')
+                                       + 1)
+        if partial:
+            self._pending = chunk[partial.start():]
+            chunk = chunk[:partial.start()]
+        return strip_ansi(chunk, *options[1:])
+
+    def flush(self):
+        ''' Return the rest of the text, a sequence never finished. '''
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return self._empty
+        return strip_ansi(pending, self.c1, self.osc, self.esc)
+
+
+def _has_c1(chunk, is_str):
+    if is_str:
+        return '\x9b' in chunk or '\x9d' in chunk
+    return b'\x9b' in chunk or b'\x9d' in chunk
+
+
+MAX_WIDTH_CACHE = 1024      # strings measured, least recently used out
+_ascii_text_finder = re.compile('[^ -~]')  # anything but printable ASCII
+_width_starts = _width_values = None  # width table, see _build_width_table
+
+
+def _build_width_table():
+    ''' Run-length encode the cell widths of code points, from U+0300 on,
+        to be searched with bisect.  Built once, from unicodedata.
+    '''
+    global _width_starts, _width_values
+    from unicodedata import category, east_asian_width
+    starts, values = array('L'), array('b')
+    last = None
+    for first, end in ((0x300, 0x40000), (0xE0000, 0xE1000)):
+        for codepoint in range(first, end):
+            char = chr(codepoint)
+            if (category(char) in ('Mn', 'Me', 'Cf')    # combining, format
+                    or 0x1160 <= codepoint <= 0x11FF):  # Hangul jamo
+                width = 0
+            elif east_asian_width(char) in 'WF':        # wide, emoji
+                width = 2
+            else:
+                width = 1
+            if width != last:
+                starts.append(codepoint)
+                values.append(width)
+                last = width
+        starts.append(end)  # narrow until next range
+        values.append(1)
+        last = 1
+    _width_starts, _width_values = starts, values
+
+
+@lru_cache(maxsize=MAX_WIDTH_CACHE)
+def display_width(text):
+    ''' Return the number of terminal cells a string occupies.
+
+        Escape sequences and zero-width characters (combining marks,
+        controls, joiners) take none, East Asian wide characters and emoji
+        two.  Skin tone modifiers after an emoji take none, and regional
+        indicators pair up into flags of two.  The string is walked once,
+        without making a stripped copy.
+    '''
+    if not _ascii_text_finder.search(text):  # the common case
+        return len(text)
+    if _width_starts is None:
+        _build_width_table()
+    starts, values = _width_starts, _width_values
+    escapes = (_strippers.get((True, True, True, True)) or
+               _get_stripper(True, True, True, True)).finditer(text)
+
+    width = 0
+    last_width = 0          # of the previous visible character
+    joined = False          # by a zero-width joiner
+    flag_half = False       # a regional indicator, waiting for its pair
+    pos = 0
+    length = len(text)
+    while pos < length:
+        match = next(escapes, None)
+        end = match.start() if match else length
+        if not _ascii_text_finder.search(text, pos, end):
+            width += end - pos
+            if end > pos:
+                last_width, joined, flag_half = 1, False, False
+            pos = match.end() if match else length
+            continue
+
+        for i in range(pos, end):
+            codepoint = ord(text[i])
+            if codepoint < 0x300:
+                char_width = (1 if 0x20 <= codepoint < 0x7F or
+                                   codepoint >= 0xA0 else 0)
+            elif codepoint == 0x200D:   # ZWJ, next is part of this glyph
+                joined = True
+                continue
+            elif codepoint == 0xFE0F:   # emoji presentation of previous
+                if last_width == 1:
+                    width += 1
+                    last_width = 2
+                continue
+            elif 0x1F3FB <= codepoint <= 0x1F3FF and last_width == 2:
+                continue                # skin tone of the previous emoji
+            elif 0x1F1E6 <= codepoint <= 0x1F1FF:   # regional indicator
+                if flag_half and not joined:
+                    flag_half = False   # second half, the flag takes two
+                    width += 1
+                    last_width = 2
+                    continue
+                char_width = 1
+            else:
+                char_width = values[bisect_right(starts, codepoint) - 1]
+            flag_half = 0x1F1E6 <= codepoint <= 0x1F1FF
+            if joined:
+                joined = False
+                continue
+            if char_width:
+                width += char_width
+                last_width = char_width
+        pos = match.end() if match else length
+    return width
+
+
 clear = clear_screen
 cls = reset_terminal
 
@@ -20,6 +20,7 @@ install_requires = (
 tests_require = ('pyflakes', 'pytest', 'readme_renderer'),
 extras_require = dict(
     webcolors=('webcolors',),
+    numpy=('numpy',),
 )
 
 def get_version(filename, version='1.00'):